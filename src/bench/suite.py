@@ -0,0 +1,371 @@
+#%%
+"""
+Benchmark suite for the purification, swapping and circuit hot paths.
+
+Run from the ``src`` directory::
+
+    python -m bench.suite --out results.json
+    python -m bench.suite --only oxbatch --out results.json
+    python -m bench.suite --compare base.json results.json
+
+Every benchmark is timed over several repeats (best and median wall time,
+throughput in items per second) and then run once more under tracemalloc
+for its peak allocated memory. Results are written as JSON together with
+the git commit and library versions, so runs can be compared across
+commits.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+#%%
+
+BENCHMARKS = {}
+
+
+def benchmark(name, sizes):
+    """
+    Registers a benchmark.
+
+    The decorated function takes a size and returns a zero-argument
+    callable performing the work, together with the number of items
+    (points, states, grid cells) that one call processes.
+
+    Parameters
+    ----------
+    name : str
+        Name of the benchmark, used in reports and for --only/--skip.
+    sizes : list[int]
+        Problem sizes to run.
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, sizes)
+        return setup
+    return register
+
+
+def _coefficients(size, seed=0):
+    """
+    Random Bell diagonal coefficients close to a useful pair.
+    """
+    rng = np.random.default_rng(seed)
+    A = rng.uniform(0.7, 0.99, size)
+    rest = rng.dirichlet(np.ones(3), size) * (1 - A)[:, np.newaxis]
+    return A, rest[:, 0], rest[:, 1], rest[:, 2]
+
+
+@benchmark("oxiter.scalar", [1000])
+def _oxiter_scalar(size):
+    from original import oxiter
+    A, B, C, D = (x.tolist() for x in _coefficients(size))
+
+    def run():
+        for a, b, c, d in zip(A, B, C, D):
+            args = (a, a, b, b, c, c, d, d, 0.99, 0.99)
+            oxiter.coeffA(*args)
+            oxiter.coeffB(*args)
+            oxiter.coeffC(*args)
+            oxiter.coeffD(*args)
+            oxiter.pparr(*args)
+            oxiter.connA(a, b, c, d, 0.99, 0.99, 0.99)
+            oxiter.connB(a, b, c, d, 0.99, 0.99, 0.99)
+            oxiter.connC(a, b, c, d, 0.99, 0.99, 0.99)
+            oxiter.connD(a, b, c, d, 0.99, 0.99, 0.99)
+    return run, size
+
+
+@benchmark("oxiter.array", [1000, 100000, 1000000])
+def _oxiter_array(size):
+    from original import oxiter
+    A, B, C, D = _coefficients(size)
+    args = (A, A, B, B, C, C, D, D, 0.99, 0.99)
+
+    def run():
+        oxiter.coeffA(*args)
+        oxiter.coeffB(*args)
+        oxiter.coeffC(*args)
+        oxiter.coeffD(*args)
+        oxiter.pparr(*args)
+        oxiter.connA(A, B, C, D, 0.99, 0.99, 0.99)
+        oxiter.connB(A, B, C, D, 0.99, 0.99, 0.99)
+        oxiter.connC(A, B, C, D, 0.99, 0.99, 0.99)
+        oxiter.connD(A, B, C, D, 0.99, 0.99, 0.99)
+    return run, size
+
+
+@benchmark("oxbatch.array", [1000, 100000, 1000000])
+def _oxbatch_array(size):
+    from original import oxbatch
+    A, B, C, D = _coefficients(size)
+
+    def run():
+        oxbatch.purifysym(A, B, C, D, 0.99, 0.99)
+        oxbatch.connect(A, B, C, D, 0.99, 0.99, 0.99)
+    return run, size
+
+
+@benchmark("qnces.ESc", [1])
+def _esc(size):
+    from original import qnces
+
+    def run():
+        for _ in range(size):
+            qnces.ESc(0.99, 0.99, 0.99, 0.97, 0.01, 0.01, 0.01)
+    return run, size
+
+
+@benchmark("qnces.QNCc", [1])
+def _qncc(size):
+    from original import qnces
+
+    def run():
+        for _ in range(size):
+            qnces.QNCc(0.99, 0.99, 0.99, 0.97, 0.01, 0.01, 0.01)
+    return run, size
+
+
+@benchmark("channels.unitary_builder", [2, 4, 6, 8, 10, 12, 14])
+def _unitary_builder(size):
+    from qutip.qip.operations import cnot, snot
+    from qutip.qip.qubits import qubit_states
+    import func.channels as channels
+    operations = [[cnot(), [0, size - 1]]]
+    if size > 2:
+        operations.append([snot(), [1]])
+    circuit = [
+        {"stage": 1, "operations": operations},
+        {"stage": 2, "operations": [[cnot(), [size - 1, 0]]]},
+    ]
+    register = qubit_states(N=size, states=[0])
+
+    def run():
+        channels._stage_cache.clear()
+        channels.unitary_builder(register, circuit)
+    return run, 1
+
+
+@benchmark("channels.trajectories", [1000, 10000])
+def _trajectories(size):
+    from circuits.repeater import es_protocol
+    import func.channels as channels
+
+    def run():
+        channels.trajectory_fidelity(es_protocol, 0.97, 0.01, 0.01, 0.01, shots=size,
+                                     seed=0, p1=0.99, p2=0.99, pproj=0.99)
+    return run, size
+
+
+@benchmark("sweep.grid", [10])
+def _sweep_grid(size):
+    from original import sweep
+
+    def run():
+        sweep.LEVELS.clear()
+        sweep.sweep(np.linspace(10, 300, size), np.arange(1, size + 1),
+                    0.99, 0.99, 0.99, 0.98, processes=1)
+    return run, size * size
+
+
+@benchmark("chainkernel.grid", [10, 100, 1000])
+def _kernel_grid(size):
+    from original import chainkernel
+
+    def run():
+        chainkernel.kernelgrid(np.linspace(10, 300, size), np.arange(1, 11),
+                               0.99, 0.99, 0.99, 0.98)
+    return run, size * 10
+
+
+@benchmark("surrogate.rounds", [1000, 100000])
+def _surrogate_rounds(size):
+    import tempfile
+    from original import surrogate
+    table = surrogate.build(os.path.join(tempfile.mkdtemp(), "surrogate"), samples=1000)
+    A, B, C, D = _coefficients(size)
+    fmin = np.random.default_rng(1).uniform(0.9, 0.99, size)
+
+    def run():
+        table.rounds(A, B, C, D, 0.99, 0.99, fmin)
+    return run, size
+
+
+#%%
+
+def measure(setup, size, repeat):
+    """
+    Times one benchmark at one size and records its peak memory.
+
+    Parameters
+    ----------
+    setup : callable
+        Registered benchmark setup function.
+    size : int
+        Problem size.
+    repeat : int
+        Number of timed repeats.
+
+    Returns
+    -------
+    result : dict
+        Timings, throughput and peak memory of the benchmark.
+    """
+    run, items = setup(size)
+    run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = min(times)
+    return {
+        "size": size,
+        "items": items,
+        "repeat": repeat,
+        "best": best,
+        "median": float(np.median(times)),
+        "throughput": items / best if best > 0 else float("inf"),
+        "peak_bytes": peak,
+    }
+
+
+def metadata():
+    """
+    Commit, interpreter and library versions of the current run.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=SRC, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    versions = {"python": platform.python_version(), "numpy": np.__version__}
+    try:
+        import qutip
+        versions["qutip"] = qutip.__version__
+    except ImportError:
+        versions["qutip"] = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "versions": versions,
+    }
+
+
+def run_suite(only=None, skip=None, repeat=5, max_size=None):
+    """
+    Runs the registered benchmarks.
+
+    Parameters
+    ----------
+    only : list[str], optional
+        Run only benchmarks whose name contains one of these strings.
+    skip : list[str], optional
+        Skip benchmarks whose name contains one of these strings.
+    repeat : int
+        Number of timed repeats per benchmark and size.
+    max_size : int, optional
+        Skip sizes above this value.
+
+    Returns
+    -------
+    report : dict
+        Run metadata and one result per benchmark and size.
+    """
+    results = []
+    for name, (setup, sizes) in BENCHMARKS.items():
+        if only and not any(pattern in name for pattern in only):
+            continue
+        if skip and any(pattern in name for pattern in skip):
+            continue
+        for size in sizes:
+            if max_size is not None and size > max_size:
+                continue
+            result = {"name": name}
+            try:
+                result.update(measure(setup, size, repeat))
+            except (ImportError, MemoryError) as error:
+                result.update({"size": size, "error": repr(error)})
+            results.append(result)
+            print("{:<28}{:>10}  {}".format(name, size, _describe(result)), flush=True)
+    return {"meta": metadata(), "results": results}
+
+
+def _describe(result):
+    if "error" in result:
+        return "error: " + result["error"]
+    return "{:.3e} s  {:.3e} items/s  {:.1f} MiB".format(
+        result["best"], result["throughput"], result["peak_bytes"] / 2**20)
+
+
+def compare(base, head):
+    """
+    Compares two saved reports benchmark by benchmark.
+
+    Parameters
+    ----------
+    base, head : dict
+        Reports produced by ``run_suite``.
+
+    Returns
+    -------
+    rows : list[tuple]
+        Name, size, best time ratio (head/base) and peak memory ratio
+        for every benchmark present in both reports.
+    """
+    def index(report):
+        return {(r["name"], r["size"]): r for r in report["results"] if "error" not in r}
+    old, new = index(base), index(head)
+    rows = []
+    for key in old:
+        if key in new:
+            rows.append(key + (new[key]["best"] / old[key]["best"],
+                               new[key]["peak_bytes"] / max(old[key]["peak_bytes"], 1)))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--out", help="write the report to this JSON file")
+    parser.add_argument("--only", nargs="*", help="run benchmarks matching these names")
+    parser.add_argument("--skip", nargs="*", help="skip benchmarks matching these names")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-size", type=int)
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"),
+                        help="compare two saved reports instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            head = json.load(f)
+        print("{:<28}{:>10}{:>12}{:>12}".format("benchmark", "size", "time x", "memory x"))
+        for name, size, time_ratio, memory_ratio in compare(base, head):
+            print("{:<28}{:>10}{:>12.3f}{:>12.3f}".format(name, size, time_ratio, memory_ratio))
+        return
+
+    report = run_suite(args.only, args.skip, args.repeat, args.max_size)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#%%
+from functools import reduce
+import numpy as np
+
+# Pauli matrices and the depolarizing noise terms of the "p1" and "p2"
+# steps of the protocols in repeater.py (pol1 and pol2 in
+# original/qnces.py). The density matrix, Pauli frame and trajectory
+# simulators all read the noise model from here. Only numpy is needed,
+# so importing it does not load QuTiP.
+
+PAULIS = {
+    "I": np.array([[1, 0], [0, 1]], dtype=complex),
+    "X": np.array([[0, 1], [1, 0]], dtype=complex),
+    "Y": np.array([[0, -1j], [1j, 0]], dtype=complex),
+    "Z": np.array([[1, 0], [0, -1]], dtype=complex),
+}
+
+# Noise terms of pol1 and pol2: every Pauli on the targets except the
+# identity (pol1), or except II, XX, YY and ZZ (pol2)
+NOISE1 = [(P,) for P in "XYZ"]
+NOISE2 = [(Pc, Pt) for Pc in "IXYZ" for Pt in "IXYZ"
+          if (Pc, Pt) not in [("I", "I"), ("X", "X"), ("Y", "Y"), ("Z", "Z")]]
+
+
+def pauli_product(labels):
+    """
+    Kronecker product of named Pauli matrices, the first label acting on
+    the first qubit.
+
+    Parameters
+    ----------
+    labels : sequence of str
+        Keys of PAULIS, e.g. ("X", "Z") or "XZ".
+
+    Returns
+    -------
+    P : ndarray
+        2^k x 2^k matrix for k labels.
+    """
+    return reduce(np.kron, [PAULIS[P] for P in labels])
@@ -0,0 +1,78 @@
+#%%
+from qutip.qip.operations import cnot, snot
+
+# Entanglement swapping (ES) and measurement based quantum network coding
+# (QNC) protocols on a register of Bell pairs, pair k holding qubits 2k and
+# 2k + 1. Operations follow the stage format of sample.py, with an optional
+# third entry naming the noise parameter of the step:
+#   [gate, targets, "p1"]       - depolarizing one qubit gate (pol1)
+#   [gate, targets, "p2"]       - depolarizing two qubit gate (pol2)
+#   ["measure", [q], "pproj"]   - faulty measurement of q (projector)
+# Steps without a noise parameter are applied exactly, and the noise terms
+# of "p1" and "p2" are defined in noise.py. "keep" lists the qubits left
+# once the protocol has run.
+
+es_protocol = {
+  "pairs": 3,
+  "keep": [0, 5],
+  "circuit": [
+    {"stage": 1, "operations": [[cnot(), [4, 3], "p2"]]},
+    {"stage": 2, "operations": [["measure", [3], "pproj"]]},
+    {"stage": 3, "operations": [[cnot(), [2, 1], "p2"]]},
+    {"stage": 4, "operations": [["measure", [1], "pproj"]]},
+    {"stage": 5, "operations": [[snot(), [2], "p1"]]},
+    {"stage": 6, "operations": [["measure", [2], "pproj"]]},
+    {"stage": 7, "operations": [[snot(), [4], "p1"]]},
+    {"stage": 8, "operations": [["measure", [4], "pproj"]]}
+  ]
+}
+
+qnc_protocol = {
+  "pairs": 7,
+  "keep": [12, 9],
+  "circuit": [
+    {"stage": 1, "operations": [[cnot(), [13, 11], "p2"], [cnot(), [9, 7], "p2"]]},
+    {"stage": 2, "operations": [["measure", [11], "pproj"], ["measure", [7], "pproj"]]},
+    {"stage": 3, "operations": [[cnot(), [10, 5], "p2"]]},
+    {"stage": 4, "operations": [[cnot(), [6, 5], "p2"]]},
+    {"stage": 5, "operations": [["measure", [5], "pproj"], [cnot(), [4, 3], "p2"]]},
+    {"stage": 6, "operations": [[cnot(), [4, 1], "p2"], ["measure", [3], "pproj"]]},
+    {"stage": 7, "operations": [["measure", [1], "pproj"], [cnot(), [2, 12], "p2"]]},
+    {"stage": 8, "operations": [[cnot(), [0, 8], "p2"]]},
+    {"stage": 9, "operations": [[snot(), [2], "p1"], [snot(), [0], "p1"]]},
+    {"stage": 10, "operations": [["measure", [2], "pproj"], ["measure", [0], "pproj"]]},
+    {"stage": 11, "operations": [[snot(), [4], "p1"]]},
+    {"stage": 12, "operations": [["measure", [4], "pproj"]]},
+    {"stage": 13, "operations": [[snot(), [6], "p1"], [snot(), [10], "p1"]]},
+    {"stage": 14, "operations": [["measure", [6], "pproj"], ["measure", [10], "pproj"]]}
+  ]
+}
+
+
+def swap_chain(pairs):
+    """
+    Entanglement swapping along a chain of Bell pairs, in the format
+    above. Pair k holds qubits 2k and 2k + 1; at every repeater the
+    qubits 2k + 1 and 2k + 2 undergo the Bell measurement of es_protocol
+    (cnot, measure the target, snot on the control, measure it), leaving
+    a pair between the first and last qubit of the chain.
+
+    Parameters
+    ----------
+    pairs : int
+        Number of Bell pairs in the chain.
+
+    Returns
+    -------
+    protocol : dict
+        Protocol with keys "pairs", "keep" and "circuit".
+    """
+    circuit = []
+    for k in range(pairs - 1):
+        a, b = 2 * k + 1, 2 * k + 2
+        circuit.extend([
+            {"stage": len(circuit) + 1, "operations": [[cnot(), [b, a], "p2"]]},
+            {"stage": len(circuit) + 2, "operations": [["measure", [a], "pproj"], [snot(), [b], "p1"]]},
+            {"stage": len(circuit) + 3, "operations": [["measure", [b], "pproj"]]},
+        ])
+    return {"pairs": pairs, "keep": [0, 2 * pairs - 1], "circuit": circuit}
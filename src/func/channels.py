@@ -1,16 +1,262 @@
 #%%
-from qutip import tensor, qeye
+from qutip import tensor, qeye, Qobj
+import numpy as np
 import math
+from collections import OrderedDict
 from functools import reduce
+from statistics import NormalDist
+from func.instrument import instrumented, section
+from func.operators import KronOperator, SparseOperator, apply_factor
+from circuits.noise import NOISE1, NOISE2, pauli_product
 
 
 #%%
 
+STAGE_CACHE_SIZE = 64
+
+_stage_cache = OrderedDict()
+
+# Bell states A, B, C, D (00 + 11, 01 - 10, 01 + 10, 00 - 11) as kets
+BELL_KETS = np.array([[1, 0, 0, 1], [0, 1, -1, 0], [0, 1, 1, 0], [1, 0, 0, -1]],
+                     dtype=complex) / np.sqrt(2)
+
+
+def _gate_key(gate):
+    """
+    Key identifying a gate by its matrix entries.
+    """
+    matrix = gate.full()
+    return (matrix.shape, matrix.tobytes())
+
+
+def _gate_tensor(gate, key, gates):
+    """
+    Returns a gate reshaped to one axis per input and output qubit,
+    shape (2,)*2k, reusing the array for gates already in ``gates``.
+
+    ``gates`` belongs to the compiled circuit, so the tensors are freed
+    with it instead of piling up for every parameterized gate ever seen.
+    """
+    if key not in gates:
+        k = int(math.log(key[0][0], 2))
+        gates[key] = gate.full().reshape((2,) * (2 * k))
+    return gates[key]
+
+
+def register_size(qubit_register):
+    """
+    Number of qubits in a register given as a ket or density matrix.
+    """
+    return int(math.log(next(x for x in qubit_register.shape if x != 1), 2))
+
+
+class CompiledCircuit:
+    """
+    Quantum circuit compiled for repeated use on registers of a fixed size.
+
+    Gates are stored once per distinct matrix and every stage keeps its
+    target qubits and the subsystem permutation needed to build its
+    unitary, so nothing is rebuilt when the circuit is reused.
+
+    An operation may give a list of Kraus operators in place of a gate,
+    ``[[K0, K1, ...], targets]``, to describe a noisy channel. Circuits
+    with channels can only be applied to density matrices, with the
+    ``"kron"`` backend.
+
+    Parameters
+    ----------
+    circuit : list[dict]
+        List of dictionaries describing steps of the circuit, in the
+        format of ``circuits.sample``.
+    no_of_qubits : int
+        Number of qubits in the registers the circuit acts on.
+    """
+
+    BACKENDS = ("kron", "csr")
+
+    def __init__(self, circuit, no_of_qubits):
+        self.no_of_qubits = no_of_qubits
+        self.stages = []
+        self._operators = {}
+        self._gates = {}
+        for slice in circuit:
+            operations = []
+            qubit_ordering = []
+            for step in slice["operations"]:
+                gates = list(step[0]) if isinstance(step[0], (list, tuple)) else [step[0]]
+                keys = tuple(_gate_key(gate) for gate in gates)
+                tensors = [_gate_tensor(gate, key, self._gates) for gate, key in zip(gates, keys)]
+                operations.append((gates, keys, tensors, list(step[1])))
+                qubit_ordering.extend(step[1])
+            qubit_ordering.extend([x for x in range(no_of_qubits) if x not in qubit_ordering])
+            stage_key = (no_of_qubits,) + tuple((keys, tuple(targets))
+                                                for _, keys, _, targets in operations)
+            self.stages.append({
+                "operations": operations,
+                "permutation": list(np.argsort(qubit_ordering)),
+                "key": stage_key,
+                "channel": any(len(operation[0]) > 1 for operation in operations),
+            })
+
+    def stage_unitary(self, index):
+        """
+        Unitary of a single stage on the full register, cached on the
+        gates and target qubits that make up the stage.
+
+        Parameters
+        ----------
+        index : int
+            Position of the stage in the circuit.
+
+        Returns
+        -------
+        stage_unitary : Qobj
+            Unitary of the stage.
+        """
+        stage = self.stages[index]
+        if stage["channel"]:
+            raise ValueError("Stage {} contains a noisy channel and has no unitary".format(index))
+        if stage["key"] in _stage_cache:
+            _stage_cache.move_to_end(stage["key"])
+        else:
+            if len(_stage_cache) >= STAGE_CACHE_SIZE:
+                _stage_cache.popitem(last=False)
+            with section("gate_expansion"):
+                operations_in_slice = [operation[0][0] for operation in stage["operations"]]
+                used = sum(len(operation[3]) for operation in stage["operations"])
+                operations_in_slice.extend([qeye(2)] * (self.no_of_qubits - used))
+                _stage_cache[stage["key"]] = tensor(operations_in_slice).permute(stage["permutation"])
+        return _stage_cache[stage["key"]]
+
+    def unitary(self):
+        """
+        Overall unitary of the circuit, with the first stage applied first.
+
+        Returns
+        -------
+        circuit_unitary : Qobj
+            Overall unitary of all operations in the circuit.
+        """
+        operation_list = [self.stage_unitary(i) for i in range(len(self.stages))]
+        with section("stage_product"):
+            return reduce((lambda x, y: y * x), operation_list)
+
+    def operators(self, backend="kron"):
+        """
+        Stage operators of the circuit in the given backend, built once
+        per compiled circuit.
+
+        Parameters
+        ----------
+        backend : str
+            ``"kron"`` keeps every stage as its gates and target qubits,
+            ``"csr"`` as a sparse matrix on the full register (unitary
+            stages only).
+
+        Returns
+        -------
+        operators : list[KronOperator] or list[SparseOperator]
+            One operator per stage, in the order they are applied.
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError("Unknown backend {}, expected one of {}".format(backend, self.BACKENDS))
+        if backend not in self._operators:
+            if backend == "csr" and any(stage["channel"] for stage in self.stages):
+                raise ValueError("The csr backend does not support noisy channels")
+            if backend == "kron":
+                operators = [KronOperator([(operation[2], operation[3])
+                                           for operation in stage["operations"]],
+                                          self.no_of_qubits)
+                             for stage in self.stages]
+            else:
+                operators = [SparseOperator(self.stage_unitary(i).data) for i in range(len(self.stages))]
+            self._operators[backend] = operators
+        return self._operators[backend]
+
+    def apply(self, qubit_register, backend="kron"):
+        """
+        Applies the circuit to a register stage by stage, without forming
+        the unitary of the whole circuit.
+
+        Parameters
+        ----------
+        qubit_register : Qobj or ndarray
+            Ket or density matrix of the register. Arrays are taken as a
+            ket of shape (2**n,) or a density matrix of shape (2**n, 2**n).
+        backend : str
+            Stage operator backend, see ``operators``.
+
+        Returns
+        -------
+        result : Qobj or ndarray
+            Register after the circuit has been applied, of the same type
+            as the input.
+        """
+        n = self.no_of_qubits
+        if isinstance(qubit_register, Qobj):
+            if register_size(qubit_register) != n:
+                raise ValueError("Register size does not match compiled circuit")
+            state = qubit_register.full()
+            if qubit_register.isket:
+                state = state.ravel()
+            state = self.evolve(state[np.newaxis], backend)[0]
+            return Qobj(state.reshape(qubit_register.shape), dims=qubit_register.dims)
+
+        return self.evolve(qubit_register[np.newaxis], backend)[0]
+
+    def evolve(self, states, backend="kron"):
+        """
+        Applies the circuit to a stack of registers at once.
+
+        Parameters
+        ----------
+        states : ndarray
+            Kets of shape (batch, 2**n) or density matrices of shape
+            (batch, 2**n, 2**n).
+        backend : str
+            Stage operator backend, see ``operators``.
+
+        Returns
+        -------
+        states : ndarray
+            Registers after the circuit, in the same layout as the input.
+        """
+        n = self.no_of_qubits
+        if states.ndim not in (2, 3) or any(d != 2**n for d in states.shape[1:]):
+            raise ValueError("Expected a stack of kets or density matrices on {} qubits".format(n))
+        if states.ndim == 2 and any(stage["channel"] for stage in self.stages):
+            raise ValueError("Noisy channels can only be applied to density matrices")
+        for operator in self.operators(backend):
+            with section("stage_apply"):
+                states = operator.apply(states, batched=True)
+        return states
+
+
+def compile_circuit(circuit, no_of_qubits):
+    """
+    Compiles a circuit for repeated use on registers of a fixed size.
+
+    Parameters
+    ----------
+    circuit : list[dict]
+        List of dictionaries describing steps of the circuit
+    no_of_qubits : int
+        Number of qubits in the registers the circuit acts on.
+
+    Returns
+    -------
+    compiled : CompiledCircuit
+        Compiled form of the circuit.
+    """
+    return CompiledCircuit(circuit, no_of_qubits)
+
+
+@instrumented("unitary_builder")
 def unitary_builder(qubit_register, circuit):
     """
     Builds a unitary transformation representing a quantum circuit
     operating on a register of qubits.
-    
+
     Parameters
     ----------
     qubit_register : Qobj
@@ -22,28 +268,269 @@ def unitary_builder(qubit_register, circuit):
     -------
     circuit_unitary : Qobj
         Overall unitary of all operations in the circuit.
-    """    
-    
-    no_of_qubits = math.log(next(x for x in qubit_register.shape if x != 1), 2)
-    qubit_ordering = []
-    operations_in_slice = []
-    operation_list = None
-    for slice in circuit:
-        for step in slice["operations"]:
-            qubit_ordering.extend(step[1])
-            operations_in_slice.extend([step[0]])
-        identity_operation_count = int(no_of_qubits - len(qubit_ordering))
-        operations_in_slice.extend([qeye(2)] * identity_operation_count)
-        qubit_ordering.extend([x for x in range(int(no_of_qubits)) if x not in qubit_ordering])
-        operation_slice = tensor(operations_in_slice).permute(qubit_ordering)
-        if operation_list is None:
-            operation_list = [operation_slice]
-        else:
-            operation_list.extend([operation_slice])
-        qubit_ordering = []
-        operations_in_slice = [] 
-            
-    circuit_unitary = reduce((lambda x, y: x * y), operation_list)
-    
-    return circuit_unitary
-        
\ No newline at end of file
+    """
+
+    return compile_circuit(circuit, register_size(qubit_register)).unitary()
+
+
+def evolve(states, circuit, backend="kron"):
+    """
+    Pushes a stack of input registers through a circuit or noisy channel
+    sequence with batched array operations.
+
+    Parameters
+    ----------
+    states : ndarray
+        Kets of shape (batch, 2**n) or density matrices of shape
+        (batch, 2**n, 2**n).
+    circuit : list[dict] or CompiledCircuit
+        Circuit to apply, compiled on the fly if given as a list.
+    backend : str
+        Stage operator backend, see ``CompiledCircuit.operators``.
+
+    Returns
+    -------
+    states : ndarray
+        Registers after the circuit, in the same layout as the input.
+    """
+    if not isinstance(circuit, CompiledCircuit):
+        circuit = compile_circuit(circuit, int(math.log(states.shape[1], 2)))
+    return circuit.evolve(states, backend)
+
+
+#%%
+
+class TrajectoryCircuit:
+    """
+    Noisy circuit evolved as quantum trajectories on state vectors.
+
+    Operations follow ``circuits.repeater``: ``[gate, targets]`` is
+    applied exactly, ``[gate, targets, name]`` is the depolarizing gate
+    of ``pol1``/``pol2`` in ``qnces.py`` with quality ``params[name]``,
+    and ``["measure", [q], name]`` is the faulty projector
+    ``diag(et, 1 - et)`` with ``et = params[name]``, applied on both
+    sides and multiplied by 2 as ``prjk`` in ``ESc``.
+
+    Every trajectory follows one branch of each noisy gate, the gate
+    with probability p and otherwise one of the Pauli noise terms with
+    probability (1 - p)/3 or (1 - p)/12, the gate being skipped as in
+    pol1/pol2. The projector is linear, so it is applied to every
+    trajectory as sqrt(2) diag(et, 1 - et). The average of the
+    unnormalised |psi><psi| over trajectories is then the density matrix
+    of the density matrix model, while each trajectory only holds 2**n
+    amplitudes instead of 4**n.
+
+    Parameters
+    ----------
+    circuit : list[dict]
+        List of dictionaries describing steps of the circuit, in the
+        format of ``circuits.repeater``.
+    no_of_qubits : int
+        Number of qubits in the registers the circuit acts on.
+    """
+
+    def __init__(self, circuit, no_of_qubits):
+        self.no_of_qubits = no_of_qubits
+        self.program = []
+        gates = {}
+        for slice in circuit:
+            for step in slice["operations"]:
+                targets = list(step[1])
+                name = step[2] if len(step) > 2 else None
+                if isinstance(step[0], str):
+                    if step[0] != "measure" or len(targets) != 1:
+                        raise ValueError("Unknown operation {} on {}".format(step[0], targets))
+                    self.program.append(("measure", None, targets, name, None))
+                    continue
+                if name is not None and len(targets) > 2:
+                    raise ValueError("Depolarizing noise is defined for one and two qubit gates only")
+                gate = _gate_tensor(step[0], _gate_key(step[0]), gates)
+                noise = None
+                if name is not None:
+                    terms = NOISE1 if len(targets) == 1 else NOISE2
+                    noise = [pauli_product(labels).reshape((2,) * (2 * len(targets)))
+                             for labels in terms]
+                self.program.append(("gate", gate, targets, name, noise))
+        self.names = sorted({step[3] for step in self.program if step[3] is not None})
+
+    def sample(self, states, params, rng):
+        """
+        Evolves a stack of kets along one sampled trajectory each.
+
+        Parameters
+        ----------
+        states : ndarray
+            Kets of shape (batch, 2**n).
+        params : dict
+            Values of the noise parameters named in the circuit.
+        rng : numpy.random.Generator
+            Random generator the noise branches are drawn from.
+
+        Returns
+        -------
+        states : ndarray
+            Unnormalised kets after the circuit, of shape (batch, 2**n).
+        """
+        n = self.no_of_qubits
+        batch = states.shape[0]
+        states = states.reshape((batch,) + (2,) * n)
+        for kind, gate, targets, name, noise in self.program:
+            rows = [1 + t for t in targets]
+            with section("trajectory_step"):
+                if kind == "measure":
+                    et = 1 if name is None else params[name]
+                    view = np.moveaxis(states, rows[0], 1)
+                    view[:, 0] *= np.sqrt(2) * et
+                    view[:, 1] *= np.sqrt(2) * (1 - et)
+                    continue
+                if name is None:
+                    states = apply_factor(states, gate, rows)
+                    continue
+                p = params[name]
+                u = rng.random(batch)
+                branch = np.full(batch, -1)
+                if p < 1:
+                    noisy = u >= p
+                    branch[noisy] = np.minimum(((u[noisy] - p) * len(noise) / (1 - p)).astype(int),
+                                               len(noise) - 1)
+                out = apply_factor(states, gate, rows)
+                for j, operator in enumerate(noise):
+                    hit = np.nonzero(branch == j)[0]
+                    if len(hit):
+                        out[hit] = apply_factor(states[hit], operator, rows)
+                states = out
+        return states.reshape(batch, 2**n)
+
+    def fidelity(self, states, target, keep):
+        """
+        Overlap of the reduced state of every trajectory on the kept
+        qubits with a target ket, <target| Tr_rest |psi><psi| |target>.
+
+        Parameters
+        ----------
+        states : ndarray
+            Kets of shape (batch, 2**n).
+        target : Qobj or ndarray
+            Ket on the kept qubits, in the order of keep.
+        keep : list[int]
+            Qubits the target is defined on.
+
+        Returns
+        -------
+        fidelity : ndarray
+            One value per trajectory.
+        """
+        n = self.no_of_qubits
+        batch = states.shape[0]
+        target = target.full().ravel() if isinstance(target, Qobj) else np.asarray(target).ravel()
+        psi = np.moveaxis(states.reshape((batch,) + (2,) * n), [1 + q for q in keep],
+                          list(range(1, 1 + len(keep))))
+        overlap = target.conj() @ psi.reshape(batch, 2**len(keep), -1)
+        return (np.abs(overlap) ** 2).sum(axis=1)
+
+    @instrumented("trajectories")
+    def run(self, initial, target, keep, shots=10000, batch=256, seed=None, confidence=0.95, **params):
+        """
+        Estimates the fidelity of the kept qubits with a target state
+        from independent trajectories, run batch at a time.
+
+        Parameters
+        ----------
+        initial : callable
+            ``initial(size, rng)`` returning ``size`` sampled input kets of
+            shape (size, 2**n), see ``bell_register``.
+        target : Qobj or ndarray
+            Ket on the kept qubits, in the order of keep.
+        keep : list[int]
+            Qubits the fidelity is taken on.
+        shots : int
+            Number of trajectories.
+        batch : int
+            Number of trajectories evolved together, bounding memory to
+            batch * 2**n amplitudes.
+        seed : int, optional
+            Seed of the random generator.
+        confidence : float
+            Confidence level of the interval around the estimate.
+        params : float
+            Values of the noise parameters named in the circuit.
+
+        Returns
+        -------
+        result : dict
+            Mean fidelity, its standard error, the normal confidence
+            interval (low, high) and the number of shots.
+        """
+        missing = [name for name in self.names if name not in params]
+        if missing:
+            raise ValueError("Missing noise parameters {}".format(missing))
+        rng = np.random.default_rng(seed)
+        values = np.empty(shots)
+        for start in range(0, shots, batch):
+            size = min(batch, shots - start)
+            states = self.sample(initial(size, rng), params, rng)
+            values[start:start + size] = self.fidelity(states, target, keep)
+        mean = values.mean()
+        error = values.std(ddof=1) / math.sqrt(shots) if shots > 1 else float("nan")
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        return {"fidelity": mean, "error": error, "low": mean - z * error,
+                "high": mean + z * error, "shots": shots}
+
+
+def bell_register(coefficients, pairs):
+    """
+    Sampler of registers of Bell diagonal pairs as kets, pair k holding
+    qubits 2k and 2k + 1. Each pair is drawn in Bell state A, B, C or D
+    with probability given by its coefficients, so the average over
+    samples is the product of the Bell diagonal pair states.
+
+    Parameters
+    ----------
+    coefficients : tuple[float]
+        Coefficients (A, B, C, D) of every pair.
+    pairs : int
+        Number of pairs in the register.
+
+    Returns
+    -------
+    initial : callable
+        ``initial(size, rng)`` returning kets of shape (size, 4**pairs).
+    """
+    weights = np.asarray(coefficients, dtype=float)
+    weights = weights / weights.sum()
+
+    def initial(size, rng):
+        states = np.ones((size, 1), dtype=complex)
+        for _ in range(pairs):
+            labels = rng.choice(4, size=size, p=weights)
+            states = (states[:, :, np.newaxis] * BELL_KETS[labels][:, np.newaxis, :]).reshape(size, -1)
+        return states
+    return initial
+
+
+def trajectory_fidelity(protocol, A, B, C, D, shots=10000, batch=256, seed=None,
+                        confidence=0.95, **params):
+    """
+    Estimates the output fidelity of a Bell pair protocol of
+    ``circuits.repeater`` with quantum trajectories, the kept qubits
+    compared against the Bell state 00 + 11 as in ``ESc``/``QNCc``.
+
+    Parameters
+    ----------
+    protocol : dict
+        Protocol with keys "pairs", "keep" and "circuit".
+    A, B, C, D : float
+        Bell coefficients of every input pair.
+    shots, batch, seed, confidence
+        See ``TrajectoryCircuit.run``.
+    params : float
+        Values of the noise parameters named in the protocol.
+
+    Returns
+    -------
+    result : dict
+        See ``TrajectoryCircuit.run``.
+    """
+    circuit = TrajectoryCircuit(protocol["circuit"], 2 * protocol["pairs"])
+    return circuit.run(bell_register((A, B, C, D), protocol["pairs"]), BELL_KETS[0],
+                       sorted(protocol["keep"]), shots, batch, seed, confidence, **params)
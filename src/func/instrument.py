@@ -0,0 +1,223 @@
+#%%
+"""
+Opt-in instrumentation of the simulation hot paths.
+
+Functions wrapped with ``instrumented`` and blocks wrapped with
+``section`` record their call count and wall time, and optionally the
+memory they allocate, under an operation name. Recording is off by
+default, in which case the wrappers only check a module flag and call
+through. Switch it on with ``enable()``, the ``session()`` context
+manager, or by setting the environment variable ``QNETS_INSTRUMENT=1``
+(``=memory`` to also trace allocations).
+
+Times and allocations are inclusive: a ``pol2`` entry also contains the
+``gate`` application recorded inside it.
+
+Peak memory per call needs ``tracemalloc.reset_peak`` (Python 3.9+). On
+older interpreters the peak of a call is taken as the memory it still
+holds when it returns, or the peak of its children if higher, which is a
+lower bound of the true peak.
+"""
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+
+#%%
+
+_enabled = False
+_memory = False
+_records = {}
+_stack = []
+_null = nullcontext()
+_reset_peak = getattr(tracemalloc, "reset_peak", None)
+
+
+def enable(memory=False):
+    """
+    Starts recording.
+
+    Parameters
+    ----------
+    memory : bool
+        Also record allocated bytes through tracemalloc. This slows the
+        instrumented code down noticeably.
+    """
+    global _enabled, _memory
+    _enabled = True
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """
+    Stops recording. Records collected so far are kept.
+    """
+    global _enabled, _memory
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _enabled = False
+    _memory = False
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    """
+    Discards all records.
+    """
+    _records.clear()
+    del _stack[:]
+
+
+def _record(name, seconds, allocated, peak):
+    entry = _records.get(name)
+    if entry is None:
+        entry = _records[name] = {"calls": 0, "seconds": 0.0, "allocated": 0, "peak": 0}
+    entry["calls"] += 1
+    entry["seconds"] += seconds
+    entry["allocated"] += allocated
+    entry["peak"] = max(entry["peak"], peak)
+
+
+@contextmanager
+def _measure(name):
+    if not _memory:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            _record(name, time.perf_counter() - start, 0, 0)
+        return
+
+#   tracemalloc keeps a single peak, so it is reset on entry and every
+#   frame on the stack remembers the highest peak seen by its children
+    current, peak = tracemalloc.get_traced_memory()
+    if _reset_peak is not None:
+        if _stack:
+            _stack[-1][1] = max(_stack[-1][1], peak)
+        _reset_peak()
+    frame = [current, 0]
+    _stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _stack.pop()
+        after, peak = tracemalloc.get_traced_memory()
+        if _reset_peak is None:
+            peak = after
+        peak = max(peak, frame[1])
+        if _stack:
+            _stack[-1][1] = max(_stack[-1][1], peak)
+        _record(name, seconds, max(after - frame[0], 0), max(peak - frame[0], 0))
+
+
+def section(name):
+    """
+    Context manager recording the enclosed block under an operation
+    name. Returns a shared no-op context while recording is off.
+
+    Parameters
+    ----------
+    name : str
+        Operation name used in the report.
+    """
+    if not _enabled:
+        return _null
+    return _measure(name)
+
+
+def instrumented(name):
+    """
+    Decorator recording every call of a function under an operation name.
+
+    Parameters
+    ----------
+    name : str
+        Operation name used in the report.
+    """
+    def wrap(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _measure(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+@contextmanager
+def session(memory=False):
+    """
+    Records the enclosed block as one run, starting from empty records.
+
+    Parameters
+    ----------
+    memory : bool
+        Also record allocated bytes, see ``enable``.
+    """
+    reset()
+    enable(memory)
+    try:
+        yield
+    finally:
+        disable()
+
+
+def report():
+    """
+    Per-operation summary of the current records.
+
+    Returns
+    -------
+    report : dict
+        Maps every operation name to its number of calls, total and mean
+        wall time in seconds, total net allocated bytes and the largest
+        peak allocation of a single call (both zero unless memory was
+        recorded).
+    """
+    out = {}
+    for name, entry in sorted(_records.items(), key=lambda item: -item[1]["seconds"]):
+        out[name] = dict(entry, mean=entry["seconds"] / entry["calls"])
+    return out
+
+
+def save(path, **meta):
+    """
+    Writes the report to a JSON file.
+
+    Parameters
+    ----------
+    path : str
+        Output file.
+    **meta
+        Extra fields stored alongside the report, e.g. run parameters.
+    """
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "operations": report()}, f, indent=2)
+
+
+def summary():
+    """
+    Report formatted as a text table.
+    """
+    lines = ["{:<20}{:>10}{:>14}{:>14}{:>14}".format("operation", "calls", "seconds",
+                                                      "allocated MiB", "peak MiB")]
+    for name, entry in report().items():
+        lines.append("{:<20}{:>10}{:>14.4f}{:>14.2f}{:>14.2f}".format(
+            name, entry["calls"], entry["seconds"], entry["allocated"] / 2**20, entry["peak"] / 2**20))
+    return "\n".join(lines)
+
+
+_mode = os.environ.get("QNETS_INSTRUMENT", "").lower()
+if _mode and _mode not in ("0", "false", "off"):
+    enable(memory=_mode == "memory")
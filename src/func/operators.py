@@ -0,0 +1,119 @@
+#%%
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+#%%
+
+def apply_factor(state, gate_tensor, axes):
+    """
+    Contracts a gate tensor of shape (2,)*2k with k axes of a state tensor.
+
+    Parameters
+    ----------
+    state : ndarray
+        State with one axis of length 2 per qubit index.
+    gate_tensor : ndarray
+        Gate with its output axes first and input axes last.
+    axes : list[int]
+        Axes of the state the gate acts on.
+
+    Returns
+    -------
+    state : ndarray
+        State with the gate applied, axes in their original order.
+    """
+    k = len(axes)
+    state = np.tensordot(gate_tensor, state, axes=(list(range(k, 2 * k)), axes))
+    return np.moveaxis(state, list(range(k)), axes)
+
+
+class KronOperator:
+    """
+    Stage operator kept as its Kronecker factors, the gates of the stage
+    and their target qubits. Identities are never stored, so memory is
+    that of the gates alone.
+
+    Parameters
+    ----------
+    factors : list[tuple]
+        Pairs of operator list and list of target qubits. Each operator
+        is a tensor of shape (2,)*2k; a single operator is a gate and
+        several are the Kraus operators of a channel.
+    no_of_qubits : int
+        Number of qubits in the register.
+    """
+
+    def __init__(self, factors, no_of_qubits):
+        self.factors = factors
+        self.no_of_qubits = no_of_qubits
+
+    @property
+    def nbytes(self):
+        return sum(gate_tensor.nbytes for gate_tensors, _ in self.factors
+                   for gate_tensor in gate_tensors)
+
+    def apply(self, state, batched=False):
+        """
+        Applies the operator to a ket of shape (2**n,) or a density
+        matrix of shape (2**n, 2**n), or to a stack of either along a
+        leading axis if batched.
+        """
+        n = self.no_of_qubits
+        lead = 1 if batched else 0
+        shape = state.shape
+        is_ket = state.ndim - lead == 1
+        state = state.reshape(shape[:lead] + (2,) * (n if is_ket else 2 * n))
+        for gate_tensors, targets in self.factors:
+            rows = [lead + t for t in targets]
+            cols = [lead + n + t for t in targets]
+            if is_ket:
+                state = apply_factor(state, gate_tensors[0], rows)
+                continue
+            out = 0
+            for gate_tensor in gate_tensors:
+                out = out + apply_factor(apply_factor(state, gate_tensor, rows),
+                                         gate_tensor.conj(), cols)
+            state = out
+        return state.reshape(shape)
+
+
+class SparseOperator:
+    """
+    Stage operator on the full register stored as a CSR sparse matrix,
+    so memory scales with its number of nonzero entries.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse matrix
+        Operator on the full register.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = csr_matrix(matrix)
+
+    @property
+    def nbytes(self):
+        return self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes
+
+    def _left(self, states):
+        """
+        Multiplies every matrix in a stack (batch, d, m) from the left.
+        """
+        batch, d, m = states.shape
+        out = self.matrix @ states.transpose(1, 0, 2).reshape(d, batch * m)
+        return out.reshape(d, batch, m).transpose(1, 0, 2)
+
+    def apply(self, state, batched=False):
+        """
+        Applies the operator to a ket of shape (2**n,) or a density
+        matrix of shape (2**n, 2**n), or to a stack of either along a
+        leading axis if batched.
+        """
+        states = state if batched else state[np.newaxis]
+        if states.ndim == 2:
+            states = (self.matrix @ states.T).T
+        else:
+            states = self._left(states)
+            states = self._left(states.conj().transpose(0, 2, 1)).conj().transpose(0, 2, 1)
+        return states if batched else states[0]
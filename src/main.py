@@ -6,8 +6,6 @@ from qutip.qip.qubits import qubit_states
 
 register = qubit_states(N=5, states=[0])
 
-circuit = csamp.sample_circuit
+circuit = channels.compile_circuit(csamp.sample_circuit, 5)
 
-unitary = channels.unitary_builder(register, circuit)
-
-result_state = unitary*register
\ No newline at end of file
+result_state = circuit.apply(register)
\ No newline at end of file
@@ -0,0 +1,61 @@
+#   Repeater chain models of entanglement swapping, purification and
+#   measurement based quantum network coding
+
+#   Nothing is imported until it is used, so a process only pays for the
+#   layer it needs:
+#   - the analytic Bell diagonal model (oxiter, oxbatch, bellchan, sweep,
+#     nesting, chainkernel, sweepstore, surrogate) needs numpy only,
+#   - the density matrix model (qnces, protocol, belldiag, pframe) and
+#     the protocol comparison of compare load QuTiP, and
+#   - report loads matplotlib when a figure is drawn.
+#   Modules and the names below are loaded on first access, e.g.
+#   original.sweepgrid imports sweep.py but neither QuTiP nor matplotlib.
+
+#   Run scripts from the src directory as modules, e.g.
+#   python -m original.mainmodel
+
+from importlib import import_module
+
+ANALYTIC = {
+    'oxiter': ['coeffA', 'coeffB', 'coeffC', 'coeffD', 'pparr',
+               'connA', 'connB', 'connC', 'connD'],
+    'oxbatch': ['purify', 'purifysym', 'connect', 'fixedpoint', 'rounds'],
+    'bellchan': ['transmission', 'fibre', 'werner'],
+    'sweep': ['chain', 'sweepgrid', 'optimum', 'streamsweep'],
+    'nesting': ['optimize', 'optimizeall'],
+    'chainkernel': ['chains', 'kernelgrid'],
+    'sweepstore': ['SweepStore'],
+    'surrogate': ['Surrogate'],
+}
+
+DENSITY = {
+    'qnces': ['ESc', 'QNCc', 'pol1', 'pol2'],
+    'protocol': ['compile_protocol'],
+    'belldiag': ['BellDiag'],
+    'pframe': ['FrameSim', 'estimate'],
+    'compare': ['comparesweep'],
+}
+
+MODULES = ['bellchan', 'belldiag', 'chainkernel', 'compare', 'localop', 'mainmodel', 'memo',
+           'nesting', 'opcache', 'oxbatch', 'oxiter', 'pframe', 'protocol', 'qnces', 'report',
+           'schedule', 'surrogate', 'sweep', 'sweepstore']
+
+_NAMES = {name: module for layer in (ANALYTIC, DENSITY)
+          for module, names in layer.items() for name in names}
+
+__all__ = sorted(_NAMES)
+
+
+def __getattr__(name):
+    if name in _NAMES:
+        value = getattr(import_module('.' + _NAMES[name], __name__), name)
+    elif name in MODULES:
+        value = import_module('.' + name, __name__)
+    else:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_NAMES) | set(MODULES))
@@ -0,0 +1,66 @@
+#   Closed form Bell diagonal description of noisy links
+
+#   A Bell pair whose qubit passes through a depolarizing channel with
+#   clean probability p (pol1 with an identity gate) keeps weight p on
+#   00 + 11 and spreads 1 - p evenly over the other three Bell states.
+#   For a Werner pair, A = (3w + 1)/4 with B = C = D = (1 - A)/3, such
+#   channels multiply the Werner parameter w by (4p - 1)/3. This replaces
+#   the pol1 and sqrtm based fidelity evaluation of mainmodel.py.
+
+#   Every function accepts floats or numpy arrays.
+
+#   Parameters
+#   ---------------
+#   length - Fibre length in km
+#   att - Attenuation coefficient of the fibre in dB/km
+#   pfib - Transmission of a fibre segment, used as the clean
+#          probability of the depolarizing channel it applies
+#   A - Coefficient of Bell basis state 00 + 11
+#   w - Werner parameter
+
+from numpy import minimum
+
+
+def transmission(length,att=0.17):
+
+#   Calculates the transmission of a fibre segment
+
+    return 10**(-att*length/10)
+
+
+def fibre(pfib):
+
+#   Calculates the coefficients (A, B, C, D) of a Bell pair after one
+#   fibre segment, A being the squared fidelity with 00 + 11
+
+    A = minimum(pfib, 1)
+    B = (1-A)/3
+    return A, B, B, B
+
+
+def werner(A):
+
+#   Calculates the Werner parameter of a pair with 00 + 11 weighting A
+
+    return ((4*A) - 1)/3
+
+
+def fromwerner(w):
+
+#   Calculates the coefficients (A, B, C, D) of a Werner pair
+
+    A = ((3*w) + 1)/4
+    B = (1-A)/3
+    return A, B, B, B
+
+
+def linkwerner(*ps):
+
+#   Calculates the Werner parameter of a perfect Bell pair after a
+#   sequence of depolarizing channels with clean probabilities ps (fibre
+#   transmissions or gate qualities, on either qubit)
+
+    w = 1
+    for p in ps:
+        w = w * werner(p)
+    return w
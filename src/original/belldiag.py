@@ -0,0 +1,209 @@
+#   Bell diagonal representation of registers built from Bell pairs, and
+#   closed form versions of the depolarizing channels pol1/pol2 of qnces.py
+
+#   A register of n pairs holds pair k on qubits 2k and 2k + 1, the same
+#   layout as tensor([wf,wf,...]) in qnces.py. Its state is stored as a
+#   weight for every combination of Bell basis labels, an array of shape
+#   (4,)*n, rather than as a 4^n x 4^n density matrix. A Pauli operator
+#   on either qubit of a pair only relabels that pair's Bell state, so
+#   the noise terms of pol1/pol2 are permutations of one axis of the
+#   weights whatever the gate, and so is the gate term when the gate is
+#   a Pauli product. Any other gate term is applied to the expanded
+#   register, and the result is dense.
+
+#   pol1 and pol2 take this path for BellDiag registers and for dense
+#   registers that BellDiag.fromdense recognises as Bell diagonal. The
+#   CNOTs, Hadamards and measurements of ESc are covered by protocol.py,
+#   which tabulates the output of a compiled protocol for every
+#   combination of pair labels (Compiled.response), so a run on a
+#   BellDiag pair only weighs that table with the pair coefficients.
+
+#   Labels
+#   ---------------
+#   0 (A) - Bell basis state 00 + 11
+#   1 (B) - Bell basis state 01 - 10
+#   2 (C) - Bell basis state 01 + 10
+#   3 (D) - Bell basis state 00 - 11
+
+from numpy import allclose, asarray, diag, moveaxis, multiply, tensordot
+from circuits.noise import NOISE1, NOISE2, PAULIS, pauli_product
+from .localop import sandwich
+from .opcache import bellkets, bellprojectors, cached
+
+#   FLIP[P][l] is the label reached by applying P to a pair with label l
+FLIP = {
+    'I': [0, 1, 2, 3],
+    'X': [2, 3, 0, 1],
+    'Y': [1, 0, 3, 2],
+    'Z': [3, 2, 1, 0],
+}
+
+BELL = ['00', '11', '10', '01']
+
+
+class BellDiag:
+
+#   Register of Bell pairs that is diagonal in the Bell basis of each pair
+
+    def __init__(self, weights):
+        self.weights = asarray(weights, dtype=float)
+        self.pairs = self.weights.ndim
+        self.N = 2 * self.pairs
+
+    @classmethod
+    def product(cls, coeffs):
+
+#   Builds the register from per-pair coefficients [(A, B, C, D), ...]
+
+        weights = asarray(coeffs[0], dtype=float)
+        for c in coeffs[1:]:
+            weights = multiply.outer(weights, asarray(c, dtype=float))
+        return cls(weights)
+
+    def pair(self, k):
+
+#   Returns the (A, B, C, D) coefficients of pair k
+
+        others = tuple(a for a in range(self.pairs) if a != k)
+        return tuple(self.weights.sum(axis=others))
+
+    def flip(self, t, P):
+
+#   Applies the Pauli P ('I', 'X', 'Y' or 'Z') to qubit t
+
+        return BellDiag(self.weights.take(FLIP[P], axis=t // 2))
+
+    def array(self):
+
+#   Expands the register into the equivalent density matrix, as a numpy
+#   array
+
+        M = bellprojectors()
+        rho = self.weights
+        for k in range(self.pairs):
+            rho = tensordot(rho, M, axes=([0], [0]))
+        n = self.pairs
+        rho = rho.transpose([2 * k for k in range(n)] + [2 * k + 1 for k in range(n)])
+        return rho.reshape(4**n, 4**n)
+
+    def dense(self):
+
+#   Expands the register into the equivalent Qobj density matrix
+
+        from qutip import Qobj
+        return Qobj(self.array(), dims=[[2] * self.N, [2] * self.N])
+
+    @classmethod
+    def fromdense(cls, rho, atol=1e-12):
+
+#   Returns the register equal to the density matrix rho (Qobj or numpy
+#   array) if rho is diagonal in the Bell basis of its pairs, or None
+
+        rho = rho.full() if hasattr(rho, 'full') else asarray(rho)
+        N = rho.shape[0].bit_length() - 1
+        if N < 2 or N % 2 or rho.shape != (2**N, 2**N):
+            return None
+        n = N // 2
+        if abs(rho[_offparity(n)]).max() > atol:
+            return None
+        V = bellkets()
+        T = rho.reshape((4,) * (2 * n))
+        for a in range(2 * n):
+            U = V.conj() if a < n else V
+            T = moveaxis(tensordot(U, T, axes=([1], [a])), 0, a)
+        T = T.reshape(4**n, 4**n)
+        weights = diag(T)
+        if not allclose(T, diag(weights), rtol=0, atol=atol) or \
+           not allclose(weights.imag, 0, rtol=0, atol=atol):
+            return None
+        return cls(weights.real.reshape((4,) * n))
+
+
+def _offparity(n):
+
+#   Returns a mask of the entries of an n pair density matrix whose row
+#   and column differ in the parity of some pair. Bell diagonal registers
+#   vanish there, which rules most other registers out cheaply.
+
+    def build():
+        parity = asarray([0, 1, 1, 0])
+        for _ in range(n - 1):
+            parity = (parity[:, None] * 2 + asarray([0, 1, 1, 0])).ravel()
+        return parity[:, None] != parity[None, :]
+    return cached(('offparity', n), build)
+
+
+def _products(k):
+
+#   Returns the labels of every k qubit Pauli product and their matrices,
+#   as an array of shape (4^k, 2^k, 2^k)
+
+    def build():
+        labels = [()]
+        for _ in range(k):
+            labels = [c + (name,) for c in labels for name in PAULIS]
+        return labels, asarray([pauli_product(c) for c in labels])
+    return cached(('paulistack', k), build)
+
+
+def pauli(gate):
+
+#   Identifies a one or two qubit gate as a product of Pauli operators
+#   (up to sign), returning a tuple of labels, or None if it is not one.
+#   Pauli products are orthogonal, so the gate's overlaps with them
+#   single out the only candidate.
+
+    U = gate.full() if hasattr(gate, 'full') else asarray(gate)
+    if U.shape not in ((2, 2), (4, 4)):
+        return None
+    labels, mats = _products(U.shape[0] // 2)
+    overlaps = tensordot(mats.conj(), U, axes=([1, 2], [0, 1])) / U.shape[0]
+    c = abs(overlaps).argmax()
+    sign = overlaps[c].real
+    if abs(abs(sign) - 1) > 1e-12 or not allclose(U, sign * mats[c]):
+        return None
+    return labels[c]
+
+
+def _flip(qob,labels,targets):
+
+#   Applies the Pauli labels[i] to qubit targets[i] for every i
+
+    for P, t in zip(labels, targets):
+        qob = qob.flip(t,P)
+    return qob
+
+
+def _channel(qob,gate,targets,p,noise,rho):
+
+#   p times the gate term plus (1 - p)/len(noise) times the sum of the
+#   noise terms, as relabellings where possible. rho is the dense matrix
+#   of qob, if the caller already has it.
+
+    W = 0
+    for labels in noise:
+        W = W + _flip(qob,labels,targets).weights
+    W = ((1-p)/len(noise)) * W
+    P = pauli(gate)
+    if P is not None:
+        return BellDiag((p * _flip(qob,P,targets).weights) + W)
+    G = gate.full() if hasattr(gate, 'full') else asarray(gate)
+    if rho is None:
+        rho = qob.array()
+    return (p * sandwich(rho,G,G,targets,qob.N)) + BellDiag(W).array()
+
+
+def bdpol1(qob,gate,t,p,rho=None):
+
+#   pol1 for gate acting on qubit t of a Bell diagonal register. Returns a
+#   BellDiag when the gate is a Pauli, and a dense numpy array otherwise.
+
+    return _channel(qob,gate,[t],p,NOISE1,rho)
+
+
+def bdpol2(qob,gate,c,t,p,rho=None):
+
+#   pol2 for gate acting on control c and target t of a Bell diagonal
+#   register, returning a BellDiag or a dense numpy array as bdpol1
+
+    return _channel(qob,gate,[c,t],p,NOISE2,rho)
@@ -0,0 +1,159 @@
+#   Compiled kernel for the whole repeater chain of sweep.py
+
+#   chain in sweep.py walks the nesting levels of one channel in Python,
+#   calling the batched recurrences of oxbatch.py on scalars. Here the
+#   segment loop, the connection and the purification loop of every
+#   (distance, nesting level, setting) point run as one native kernel over
+#   flat parameter arrays when numba is installed, with the points spread
+#   over every core. The recurrences are the functions of oxbatch.py
+#   compiled as they are, so both paths use the same grouping of terms.
+
+#   Without numba, the same chains are run level by level on whole arrays
+#   with oxbatch.connect and oxbatch.rounds, so results match either way
+#   (up to the 12 significant figures sweep.py rounds its cache keys to).
+
+#   The fixed points of the purification map are found up front with
+#   oxbatch.fixedpoint, once per distinct (pproj, p2).
+
+#   Parameters
+#   ---------------
+#   L - Channel lengths in km
+#   xn - Nesting levels
+#   NN - Nesting levels to consider
+#   p1, p2, pproj - Gate and measurement qualities, as in oxiter.py
+#   fmin - Desired output fidelity
+#   att - Attenuation coefficient of the fibre in dB/km
+#   backend - 'numba', 'numpy' or None for numba when it is installed
+#   maxiter - Largest number of purification rounds per level
+
+from numpy import (asarray, atleast_1d, broadcast_arrays, empty, isnan, meshgrid, nan,
+                   nonzero, zeros)
+from .bellchan import fibre, transmission
+from .oxbatch import connect, fixedpoint, purify, rounds
+
+try:
+    from numba import njit, prange
+    NUMBA = True
+except ImportError:
+    NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+
+_purify = njit(cache=True)(purify)
+_connect = njit(cache=True)(connect)
+
+
+@njit(cache=True)
+def _chain(il,xn,p1,p2,pproj,fmin,att,Astar,Bstar,Cstar,Dstar,maxiter):
+
+#   Expenditure of one channel, as sweep.chain
+
+    A = min(10**(-att*(il/(2**xn))/10), 1.0)
+    B = (1-A)/3
+    C = B
+    D = B
+    margin = (fmin - Astar) / 4
+    AP = 0.0
+    for j in range(xn):
+        A, B, C, D = _connect(A,B,C,D,pproj,p1,p2)
+        G = 2.0
+        if A <= fmin:
+            G = 1.0
+            n = 0
+            while A < fmin:
+                if n == maxiter:
+                    G = nan
+                    break
+                A, B, C, D, N = _purify(A,A,B,B,C,C,D,D,pproj,p2)
+                n = n + 1
+                G = G * (2/N)
+                if A >= fmin:
+                    break
+                dist = max(max(abs(A - Astar), abs(B - Bstar)),
+                           max(abs(C - Cstar), abs(D - Dstar)))
+                if (margin > 0 and dist < margin) or (max(max(A, B), max(C, D)) <= 0.5 and fmin > 0.5):
+                    G = nan
+                    break
+        AP = AP + ((2.0 ** (xn - 1 - j)) * G)
+        if G != G:
+            break
+    return AP
+
+
+@njit(parallel=True, cache=True)
+def _chains(il,xn,p1,p2,pproj,fmin,att,Astar,Bstar,Cstar,Dstar,maxiter,out):
+
+#   Runs _chain for every point of the flat parameter arrays
+
+    for k in prange(len(il)):
+        out[k] = _chain(il[k],xn[k],p1[k],p2[k],pproj[k],fmin[k],att[k],
+                        Astar[k],Bstar[k],Cstar[k],Dstar[k],maxiter)
+
+
+def _numpy(il,xn,p1,p2,pproj,fmin,att,star,maxiter):
+
+#   Runs the chains of the flat parameter arrays level by level, with
+#   one batched connection and one batched purification per level
+
+    A, B, C, D = (x.copy() for x in broadcast_arrays(*fibre(transmission(il/(2.0**xn),att))))
+    AP = zeros(len(il))
+    for j in range(int(xn.max(initial=0))):
+        idx = nonzero((j < xn) & ~isnan(AP))
+        if len(idx[0]) == 0:
+            break
+        a, b, c, d = connect(A[idx],B[idx],C[idx],D[idx],pproj[idx],p1[idx],p2[idx])
+        G = zeros(len(a)) + 2
+        low = nonzero(a <= fmin[idx])
+        if len(low[0]):
+            sub = tuple(x[idx][low] for x in (pproj, p2, fmin))
+            n, G[low], a[low], b[low], c[low], d[low], reached = \
+                rounds(a[low],b[low],c[low],d[low],*sub,maxiter,star=tuple(x[idx][low] for x in star))
+        A[idx], B[idx], C[idx], D[idx] = a, b, c, d
+        AP[idx] = AP[idx] + ((2.0 ** (xn[idx] - 1 - j)) * G)
+    return AP
+
+
+def chains(L,xn,p1,p2,pproj,fmin,att=0.17,backend=None,maxiter=1000):
+
+#   Calculates the Bell pair expenditure of every channel, as
+#   sweep.chain, with every argument broadcast against the others.
+#   Returns an array of the broadcast shape holding nan where fmin cannot
+#   be reached.
+
+    if backend is None:
+        backend = 'numba' if NUMBA else 'numpy'
+    if backend not in ('numba', 'numpy'):
+        raise ValueError("Unknown backend %s" % backend)
+    if backend == 'numba' and not NUMBA:
+        raise ImportError("The numba backend needs numba to be installed")
+
+    args = broadcast_arrays(*(asarray(x, dtype=float) for x in (L, xn, p1, p2, pproj, fmin, att)))
+    shape = args[0].shape
+    il, xn, p1, p2, pproj, fmin, att = (x.ravel() for x in args)
+    xn = xn.astype(int)
+    star = fixedpoint(pproj,p2)
+    if backend == 'numba':
+        out = empty(len(il))
+        _chains(il,xn,p1,p2,pproj,fmin,att,*star,maxiter,out)
+    else:
+        out = _numpy(il,xn,p1,p2,pproj,fmin,att,star,maxiter)
+    return out.reshape(shape)
+
+
+def kernelgrid(L,NN,p1,p2,pproj,fmin,att=0.17,backend=None):
+
+#   Calculates the same expenditure grid as sweep.sweepgrid, of shape
+#   (settings, len(L), len(NN)), in a single call to chains
+
+    from .sweep import settings
+    L = atleast_1d(L)
+    NN = atleast_1d(NN)
+    combos = asarray(settings(p1,p2,pproj,fmin), dtype=float).reshape(-1, 4)
+    s, l, n = meshgrid(range(len(combos)), range(len(L)), range(len(NN)), indexing='ij')
+    p1, p2, pproj, fmin = (combos[s, k] for k in range(4))
+    return chains(L[l],NN[n],p1,p2,pproj,fmin,att,backend)
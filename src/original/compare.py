@@ -0,0 +1,224 @@
+#   Comparison of network protocols run over the same repeater channels
+
+#   Every protocol consumes Bell pairs delivered by the nested swapping
+#   and purification chain of sweep.py. The chain (fibre fidelities,
+#   connections and purification rounds, memoized per level by
+#   sweep.level) and its expenditure grid over link thresholds fmin and
+#   nesting levels are computed once and shared by all protocols. Each
+#   protocol then makes its own choice on top of the shared grid:
+#   - its expenditure at a link threshold and nesting level is the
+#     channel expenditure times the number of channels it consumes a pair
+#     from (8 for ES and 7 for QNC over the butterfly network, the factors
+#     of mainmodel.py),
+#   - its output fidelity there comes from its density matrix model (ESc
+#     or QNCc of qnces.py) applied to the delivered pair, and
+#   - it takes the cheapest link threshold and nesting level whose output
+#     fidelity reaches its target.
+#   A protocol that needs better pairs thus pays for them, and the
+#   protocols are compared at the same output quality. The density
+#   matrix evaluations are the expensive part, so they are spread over a
+#   process pool as one task per protocol and row, each walking the
+#   candidates from the cheapest up. Only the workers load QuTiP when
+#   processes > 1. With path set, the results are written to a
+#   sweepstore.SweepStore chunk by chunk, and an interrupted comparison
+#   picks up where it stopped.
+
+#   The target should lie below the output fidelity a protocol reaches
+#   with perfect pairs at the given gate and measurement qualities (about
+#   0.90 for ES and 0.76 for QNC at p1 = p2 = pproj = 0.99), and fmin
+#   should reach high enough for the target to be met, or the protocol
+#   gets no chain at all.
+
+#   The result is one row per noise setting (p1, p2, pproj) and distance,
+#   with the fields of ROW followed by, for every protocol,
+#   <name>_expenditure - Bell pairs per channel, as in sweep.TABLE
+#   <name>_total - Bell pairs over all channels of the protocol
+#   <name>_fidelity - Output fidelity of the protocol
+#   <name>_nesting - Nesting level of the chosen chain
+#   <name>_fmin - Link threshold of the chosen chain
+#   where expenditure, fidelity and fmin are nan and nesting 0 if the
+#   target is never reached.
+
+#   Parameters
+#   ---------------
+#   grid - Expenditure grid of sweep.sweepgrid (or SweepStore.grid) over
+#          the same L, NN, p1, p2, pproj and fmin
+#   L - Channel lengths in km
+#   NN - Nesting levels to consider
+#   p1, p2, pproj - Gate and measurement qualities, as in oxiter.py. Each
+#                   may be a single value or a sequence of values
+#   fmin - Link thresholds to consider, a single value or a sequence
+#   target - Output fidelity every protocol must reach, a single value or
+#            a dictionary with one value per protocol
+#   protocols - Names of the protocols to compare, keys of PROTOCOLS
+#   att - Attenuation coefficient of the fibre in dB/km
+#   processes - Number of worker processes (None uses every core,
+#               1 runs in the calling process)
+#   path - Directory of the result store of the comparison, or None
+#   chunk - Number of (protocol, row) tasks per stored chunk
+
+from importlib import import_module
+from multiprocessing import Pool
+from os import cpu_count
+from numpy import array, atleast_1d, isnan, nan, zeros
+from .bellchan import transmission
+from .memo import LRUCache, roundkey
+from .sweep import level, settings, sweepgrid
+from .sweepstore import SweepStore
+
+#   name: (module, function, channels). function(p1, p2, pproj, A, B, C, D)
+#   returns the output fidelity of the protocol
+PROTOCOLS = {
+    'ES': ('qnces', 'ESc', 8),
+    'QNC': ('qnces', 'QNCc', 7),
+}
+
+ROW = [('p1', float), ('p2', float), ('pproj', float), ('distance', float)]
+
+RESULTS = LRUCache(4096)
+
+
+def link(il,xn,p1,p2,pproj,fmin,att=0.17):
+
+#   Returns the coefficients (A, B, C, D) of the pair a channel of
+#   length il delivers after xn nesting levels, or None if it cannot
+#   reach fmin
+
+    if xn < 1:
+        return None
+    A, B, C, D, G = level(transmission(il/(2**xn),att),xn-1,p1,p2,pproj,fmin)
+    if isnan(G):
+        return None
+    return A, B, C, D
+
+
+def _evaluate(name,p1,p2,pproj,A,B,C,D):
+
+#   Output fidelity of one protocol for one delivered pair, cached per
+#   process on the rounded inputs
+
+    key = roundkey(name, p1, p2, pproj, A, B, C, D)
+    out = RESULTS.get(key)
+    if out is None:
+        module, function, _ = PROTOCOLS[name]
+        out = float(getattr(import_module('.' + module, __package__), function)(p1,p2,pproj,A,B,C,D))
+        RESULTS.put(key, out)
+    return out
+
+
+def _choose(task):
+
+#   Walks the candidate (expenditure, fmin, nesting) chains of one row
+#   from the cheapest up and returns the first whose output fidelity
+#   reaches the target, as (expenditure, fidelity, nesting, fmin)
+
+    name, il, p1, p2, pproj, target, candidates, att = task
+    for expenditure, fmin, xn in candidates:
+        pair = link(il,xn,p1,p2,pproj,fmin,att)
+        if pair is None:
+            continue
+        fidelity = _evaluate(name,p1,p2,pproj,*pair)
+        if fidelity >= target:
+            return expenditure, fidelity, xn, fmin
+    return nan, nan, 0, nan
+
+
+def columns(protocols):
+
+#   Fields of the comparison table for the given protocols
+
+    return ROW + [('%s_%s' % (name, field), kind) for name in protocols
+                  for field, kind in (('expenditure', float), ('total', float),
+                                      ('fidelity', float), ('nesting', int),
+                                      ('fmin', float))]
+
+
+def _run(tasks,pool,workers):
+
+#   Evaluates tasks in the calling process, or spread over the pool
+
+    if pool is None:
+        return list(map(_choose, tasks))
+    return pool.map(_choose, tasks, max(1, len(tasks) // (4 * workers)))
+
+
+def compare(grid,L,NN,p1,p2,pproj,fmin,target,protocols=('ES', 'QNC'),att=0.17,processes=None,
+            path=None,chunk=16):
+
+#   Picks the cheapest chain reaching the target for every protocol,
+#   setting and distance from the shared expenditure grid
+
+    unknown = [name for name in protocols if name not in PROTOCOLS]
+    if unknown:
+        raise ValueError("Unknown protocols %s" % unknown)
+    if not isinstance(target, dict):
+        target = {name: target for name in protocols}
+    target = {name: float(target[name]) for name in protocols}
+    L = atleast_1d(L)
+    NN = atleast_1d(NN)
+    fmins = atleast_1d(fmin)
+    noise = settings(p1,p2,pproj,fmin)[::len(fmins)]
+    grid = grid.reshape(len(noise), len(fmins), len(L), len(NN))
+
+    out = zeros((len(noise), len(L)), dtype=columns(protocols))
+    for k, name in enumerate(['p1', 'p2', 'pproj']):
+        out[name] = [[combo[k]] for combo in noise]
+    out['distance'] = L
+    tasks = []
+    for s, (q1, q2, qproj, _) in enumerate(noise):
+        for l, il in enumerate(L):
+            candidates = sorted((grid[s, f, l, k], float(fmins[f]), int(NN[k]))
+                                for f in range(len(fmins)) for k in range(len(NN))
+                                if not isnan(grid[s, f, l, k]))
+            for name in protocols:
+                tasks.append((name, float(il), float(q1), float(q2), float(qproj),
+                              target[name], candidates, att))
+
+    workers = processes or cpu_count()
+    pool = None if processes == 1 else Pool(workers)
+    try:
+        if path is None:
+            results = _run(tasks,pool,workers)
+        else:
+            params = {'L': L, 'NN': NN, 'p1': p1, 'p2': p2, 'pproj': pproj, 'fmin': fmin,
+                      'target': target, 'protocols': list(protocols), 'att': att}
+            store = SweepStore(path, params, len(tasks), chunk)
+            for c in store.pending():
+                rows = _run([tasks[k] for k in store.span(c)],pool,workers)
+                store.write(c, array(rows, dtype=float), zeros(0))
+            results = [tuple(row) for row in store.grid()]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    out = out.ravel()
+    for k, (task, result) in enumerate(zip(tasks, results)):
+        name = task[0]
+        row = out[k // len(protocols)]
+        expenditure, fidelity, xn, f = result
+        row['%s_expenditure' % name] = expenditure
+        row['%s_total' % name] = PROTOCOLS[name][2] * expenditure
+        row['%s_fidelity' % name] = fidelity
+        row['%s_nesting' % name] = xn
+        row['%s_fmin' % name] = f
+    return out
+
+
+def comparesweep(L,NN,p1,p2,pproj,fmin,target,protocols=('ES', 'QNC'),att=0.17,processes=None,
+                 path=None,chunk=16):
+
+#   Runs the shared sweep once and compares the protocols over it
+
+    grid = sweepgrid(L,NN,p1,p2,pproj,fmin,att,processes)
+    return compare(grid,L,NN,p1,p2,pproj,fmin,target,protocols,att,processes,path,chunk)
+
+
+def tocsv(table,filename,fields=('distance', 'ES_expenditure', 'QNC_expenditure')):
+
+#   Writes the chosen fields of a comparison table to a CSV file
+
+    with open(filename, 'w') as f:
+        f.write('# ' + ','.join(fields) + '\n')
+        for row in table:
+            f.write(','.join(repr(row[name].item()) for name in fields) + '\n')
@@ -0,0 +1,85 @@
+#   Application of one and two qubit operators and channels to an N qubit
+#   density matrix without expanding them to the full register
+
+#   The 2^N x 2^N density matrix is viewed as a rank 2N tensor with one
+#   axis of length 2 per row qubit and per column qubit. An operator on
+#   k target qubits is then a contraction over 2k axes, costing
+#   O(4^N * 2^k) operations and no full-register operator. Qubit 0 is the
+#   leftmost factor of the tensor product, as in qutip. The axis lists
+#   for each (N, targets) come from the shared registry in opcache.py.
+
+#   Parameters
+#   ---------------
+#   rho - Density matrix as a 2^N x 2^N numpy array
+#   N - Number of qubits in the register
+#   targets - List of the qubits an operator acts on, in the order of
+#             its tensor factors (control first for two qubit gates)
+
+from numpy import moveaxis, tensordot, trace, zeros
+from .opcache import ptraceplan, sandwichplan, twirlplan
+
+
+def sandwich(rho,left,right,targets,N):
+
+#   Calculates left * rho * right, where left and right act on targets
+
+    k = len(targets)
+    rows, cols, front, back, last = sandwichplan(N,targets)
+    T = rho.reshape((2,) * (2 * N))
+    L = left.reshape((2,) * (2 * k))
+    R = right.reshape((2,) * (2 * k))
+
+    T = tensordot(L, T, axes=(back, rows))
+    T = moveaxis(T, front, rows)
+    T = tensordot(T, R, axes=(cols, front))
+    T = moveaxis(T, last, cols)
+    return T.reshape(2**N, 2**N)
+
+
+def kraus(rho,ops,targets,N):
+
+#   Applies the map sum_K K * rho * K^dagger, where every K acts on targets
+
+    out = zeros(rho.shape, dtype=complex)
+    for K in ops:
+        out += sandwich(rho,K,K.conj().T,targets,N)
+    return out
+
+
+def twirl(rho,targets,N):
+
+#   Calculates the sum of P * rho * P over every Pauli operator P on
+#   targets (identity included), which equals 2^k times the identity on
+#   targets tensored with the partial trace of rho over them
+
+    k = len(targets)
+    d = 2**k
+    axes, front = twirlplan(N,targets)
+    T = moveaxis(rho.reshape((2,) * (2 * N)), axes, front)
+    rest = T.shape[2 * k:]
+    T = T.reshape(d, d, -1)
+    out = zeros(T.shape, dtype=complex)
+    reduced = d * trace(T, axis1=0, axis2=1)
+    for a in range(d):
+        out[a, a] = reduced
+    out = out.reshape((2,) * (2 * k) + rest)
+    return moveaxis(out, front, axes).reshape(2**N, 2**N)
+
+
+def ptrace(rho,keep,N):
+
+#   Traces out every qubit not in keep. Kept qubits stay in ascending
+#   order, as in Qobj.ptrace.
+
+    order, dk, do = ptraceplan(N,keep)
+    T = rho.reshape((2,) * (2 * N)).transpose(order)
+    return trace(T.reshape(dk, do, dk, do), axis1=1, axis2=3)
+
+
+def permute(rho,order,N):
+
+#   Reorders the qubits so that new qubit i is old qubit order[i], as in
+#   Qobj.permute
+
+    T = rho.reshape((2,) * (2 * N)).transpose(list(order) + [N + q for q in order])
+    return T.reshape(2**N, 2**N)
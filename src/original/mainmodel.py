@@ -1,11 +1,28 @@
-from qutip import * 
-import time
-import matplotlib.patches as mpatches
+#   Bell pair expenditure of nested entanglement swapping (ES) and
+#   quantum network coding (QNC) over distance
 
-from numpy import *
-from qnces import *
-import matplotlib.pyplot as plt
-from oxiter import * 
+#   Run from the src directory with python -m original.mainmodel. The
+#   repeater chain is swept once over every link threshold in
+#   thresholds and shared by two outputs:
+#   - 4kEXDes1.csv, as in the original script: the per channel
+#     expenditure of the cheapest chain purifying to fmin, and
+#   - the protocol comparison, where ES and QNC each pick the cheapest
+#     threshold and nesting level whose output fidelity (ESc/QNCc)
+#     reaches target. Its figure shows the expenditure over all channels
+#     of each protocol, 4kEXDQNC1.csv the per channel expenditure of QNC
+#     and 4kEXDcompare1.csv the choices of both.
+#   QuTiP is only loaded by the workers evaluating ESc/QNCc, and
+#   matplotlib by report.py when the figure is drawn.
+
+#   With p2 = pproj = 0.99 purification saturates at A = 0.986, where QNC
+#   delivers an output fidelity of about 0.70 against 0.85 for ES. target
+#   must stay below what the weaker protocol can reach, or it gets no
+#   chain at all; 0.65 leaves QNC a choice of thresholds.
+
+from numpy import isclose, linspace
+from . import report
+from .compare import compare, tocsv
+from .sweep import streamsweep
 
 att = 0.17 # atteneuation coefficient of fibre
 L =  linspace(10,300,30) # length of channel
@@ -14,90 +31,33 @@ p1 = 0.99 # 1 qubit gate quality
 p2 = 0.99 # 2 qubit gate quality
 pproj = 0.99 # measurment projector quality
 fmin = 0.98 # desired output fidelity
-bellmetric = ket2dm(bell_state()) # Bell state to compare fidelities
-fidi = empty((0,3))
-z = 0
+thresholds = linspace(0.9,0.98,5) # link fidelities the protocols may purify to
+target = 0.65 # output fidelity both protocols must deliver
+
+if __name__ == "__main__":
 
-for il in L:
-    minn = empty((0,3))
-    for xn in NN:
-        z = 1
-        G = 1
-        AN = 0
-        AP = 0
-        j = 0
-        i = 0
-        pfib = (10**(-att*(il/(2**xn)/10)))
-        print(pfib)
-        bellfibre = pol1(bellmetric,qeye(2),2,1,pfib)
-        A = (fidelity(bellfibre,bellmetric))**2
-        print(A)
-        if A > 1:
-            A = 1
-        B = C = D = (1-A)/3
-        while j < xn:
-            At = A
-            Bt = B
-            Ct = C
-            Dt = D
-            A = connA(At,Bt,Ct,Dt,pproj,p1,p2)
-            B = connB(At,Bt,Ct,Dt,pproj,p1,p2)
-            C = connC(At,Bt,Ct,Dt,pproj,p1,p2)
-            D = connD(At,Bt,Ct,Dt,pproj,p1,p2)
-            numseg = (2 ** (xn - 1 - j))
-            if A > fmin:
-                G = 2
-            else:
-                while A < fmin:
-                    At = A
-                    Bt = B
-                    Ct = C
-                    Dt = D
-                    A = coeffA(At,At,Bt,Bt,Ct,Ct,Dt,Dt,pproj,p2)
-                    B = coeffB(At,At,Bt,Bt,Ct,Ct,Dt,Dt,pproj,p2)
-                    C = coeffC(At,At,Bt,Bt,Ct,Ct,Dt,Dt,pproj,p2)
-                    D = coeffD(At,At,Bt,Bt,Ct,Ct,Dt,Dt,pproj,p2)
-                    N = pparr(At,At,Bt,Bt,Ct,Ct,Dt,Dt,pproj,p2)
-                    G = G*(2/N)
-                    i = i + 1
-                    if i > 1000:
-                        A = fmin
-                        G = -1000
-                        j = xn
-            AN = numseg * G
-            AP = AP + AN
-            j = j + 1
-            i = 0
-            G = 1
-        if AP > 0:
-            minn = append (minn , [[AP , il, xn]] , axis=0)
-            print(diagstate(A,B,C,D))
-        
-    amin = minn[0,0]
-    while z < len(minn)-1:
-        if minn[z,0] == min(minn[:,0]):
-            NT1 = minn[z]
-            z = len(minn)
-        else: 
-            z = z + 1
-    fidi = append(fidi , [NT1] , axis=0)
-#    fidi2 = fidi
-#########################################
+    # The sweep and the comparison are streamed to the 4kEXDes1 and
+    # 4kEXDcompare1 directories, one (setting, distance) task and one
+    # distance respectively per chunk; rerunning after an interruption
+    # resumes from the last completed chunk of either
+    store = streamsweep("4kEXDes1",L,NN,p1,p2,pproj,thresholds,att,chunk=1)
+    table = store.table()
+    fixed = table[isclose(table['fmin'],fmin)]
+    both = compare(store.grid(),L,NN,p1,p2,pproj,thresholds,target,('ES', 'QNC'),att,
+                   path="4kEXDcompare1",chunk=2)
+    #########################################
 
-# GENERATES FIG (A) ##
-plt.xlabel('Distance/km')
-plt.ylabel('Bell pair expenditure')
-plt.grid()
-plt.title("Resource expenditure over distance (A)")
-plt.plot(fidi[:,1],fidi[:,0]*8,'g',fidi2[:,1],fidi2[:,0]*7,'r')
-plt.legend(['$ES$','$QNC$'], loc='upper left')
-plt.savefig("4kEXD1.eps",format="eps")
+    # GENERATES FIG (A) ##
+    report.expenditure([(both['distance'],both['ES_total'],'$ES$','g'),
+                        (both['distance'],both['QNC_total'],'$QNC$','r')],"4kEXD1.eps")
 
-plt.show()
+    # Per channel expenditure, unscaled as in the original CSVs
+    tocsv(fixed, "4kEXDes1.csv", ('expenditure', 'distance'))
+    tocsv(both, "4kEXDQNC1.csv", ('QNC_expenditure', 'distance'))
+    tocsv(both, "4kEXDcompare1.csv", ('distance',
+                                      'ES_nesting', 'ES_fmin', 'ES_total', 'ES_fidelity',
+                                      'QNC_nesting', 'QNC_fmin', 'QNC_total', 'QNC_fidelity'))
 
-savetxt("4kEXDes1.csv", fidi[:,0:2], delimiter=",",header = "Expenditure,Distance")
-savetxt("4kEXDQNC1.csv", fidi2[:,0:2], delimiter=",",header = "Expenditure,Distance")
-    
 
 ##########################################
 
@@ -105,23 +65,11 @@ savetxt("4kEXDQNC1.csv", fidi2[:,0:2], delimiter=",",header = "Expenditure,Dista
 ##########################################
 
 # GENERATES FIG (B) ##
-#fig, ax1 = plt.subplots()
-#ax2 = ax1.twinx()
-#ax1.grid()
-#plt.title("Closer look at resource jumps between 100-400km (B)")
-#ax1.plot(fidi[:,1],fidi[:,2],'go',label='ES Optimal')
-#ax1.plot(fidi2[:,1],fidi2[:,2],'ro',label='QNC Optimal')
-#ax2.plot(fidi[:,1],fidi[:,0]*8,'g',label='ES')
-#ax2.plot(fidi2[:,1],fidi2[:,0]*7,'r',label='QNC')
-#ax1.set_xlabel('Distance/km')
-#ax1.set_ylabel('Optimal Nesting Level', color='k')
-#ax2.set_ylabel('Bell Pair Expenditure', color='k')
-#ax1.legend(loc='upper left')
-#ax2.legend(loc='lower right')
-#plt.savefig("4000OPMNLDIS05.eps",formate="eps")
-#plt.show()
-#savetxt("400OPMNLDISES05p.csv", fidi, delimiter=",",header = "Expenditure,Distance,OPM Nesting Level")
-#savetxt("400OPMNLDISQNC05p.csv", fidi2, delimiter=",",header = "Expenditure,Distance,OPM Nesting Level")
+#report.nesting([(both['distance'],both['ES_total'],'ES','g'),
+#                (both['distance'],both['QNC_total'],'QNC','r')],
+#               [(both['distance'],both['ES_nesting'],'ES Optimal','go'),
+#                (both['distance'],both['QNC_nesting'],'QNC Optimal','ro')],
+#               "4000OPMNLDIS05.eps")
 
 
 ##########################################
@@ -0,0 +1,73 @@
+#   Bounded least recently used cache with hit/miss statistics, used to
+#   memoize repeated evaluations of the repeater model
+
+#   Keys built with roundkey round every float to a fixed number of
+#   significant digits, so values that differ only by floating point
+#   noise (e.g. L/2**xn reached from different (L, xn) pairs) share an
+#   entry.
+
+#   With maxbytes set, the cache also bounds the total size of its
+#   values, as reported by the nbytes passed to put. Values larger than
+#   maxbytes on their own are not stored.
+
+from collections import OrderedDict
+
+
+def roundkey(*args, digits=12):
+
+#   Builds a hashable cache key, rounding floats to digits significant
+#   figures
+
+    return tuple(float('%.*g' % (digits, a)) if isinstance(a, float) else a
+                 for a in args)
+
+
+class LRUCache:
+
+#   Mapping that holds at most maxsize entries (and maxbytes bytes),
+#   evicting the least recently used one when full
+
+    def __init__(self, maxsize=4096, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.data = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits = self.hits + 1
+            return self.data[key]
+        self.misses = self.misses + 1
+        return default
+
+    def put(self, key, value, nbytes=0):
+        if self.maxbytes is not None and nbytes > self.maxbytes:
+            return
+        self.nbytes = self.nbytes - self.sizes.get(key, 0) + nbytes
+        self.sizes[key] = nbytes
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize or \
+                (self.maxbytes is not None and self.nbytes > self.maxbytes):
+            old, _ = self.data.popitem(last=False)
+            self.nbytes = self.nbytes - self.sizes.pop(old)
+
+    def clear(self):
+        self.data.clear()
+        self.sizes.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        calls = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.data),
+                'maxsize': self.maxsize, 'nbytes': self.nbytes, 'maxbytes': self.maxbytes,
+                'hitrate': self.hits / calls if calls else 0.0}
@@ -0,0 +1,178 @@
+#   Branch and bound search for the cheapest nesting level of a repeater
+#   channel, optionally choosing per level whether to purify, with the
+#   Pareto front of Bell pair expenditure against final fidelity
+
+#   The expenditure of xn nesting levels is AP = sum_j 2**(xn - 1 - j) G_j,
+#   where G_j is the yield factor of level j. A connection alone costs
+#   G = 2 and purification only adds to it (each round multiplies by
+#   2/N >= 2), so levels j..xn-1 cost at least 2 * (2**(xn - j) - 1).
+#   This bound prunes
+#   - whole nesting levels, once 2 * (2**xn - 1) is no cheaper than the
+#     best plan found so far (and every deeper level with it), and
+#   - partial plans, once their expenditure so far plus the bound for
+#     the remaining levels is no cheaper.
+#   The best plan is seeded with the usual purify-at-every-level chain of
+#   sweep.py, so most nesting levels are cut after a few levels.
+
+#   With placement, each level either purifies up to fmin (as in
+#   sweep.level) or only connects, and the search runs over these
+#   choices depth first. Without it every level purifies, as in sweep.py.
+
+#   The front is taken over every plan ending with a fidelity of at least
+#   floor and costing at most slack times the cheapest plan that reaches
+#   fmin (all plans if none does). Pruning against that cost never drops
+#   such a plan, so with slack = 1 the front holds the plans that trade
+#   fidelity for a lower expenditure and, with slack > 1, also those that
+#   buy fidelity above fmin for more.
+
+#   Parameters
+#   ---------------
+#   il - Channel length in km
+#   NN - Nesting levels to consider
+#   p1, p2, pproj - Gate and measurement qualities, as in oxiter.py
+#   fmin - Desired output fidelity
+#   att - Attenuation coefficient of the fibre in dB/km
+#   placement - Search over where to purify as well as the nesting level
+#   slack - Keep plans up to slack times the cheapest expenditure
+#   floor - Lowest final fidelity kept on the front
+
+from numpy import atleast_1d, concatenate, inf, isnan, nan, zeros
+from .bellchan import fibre, transmission
+from .memo import LRUCache, roundkey
+from .oxbatch import connect, rounds
+from .sweep import TABLE, attractor, level
+
+STEPS = LRUCache(65536)
+
+FRONT = [('distance', float), ('expenditure', float), ('fidelity', float),
+         ('nesting', int), ('purified', int)]
+
+
+def step(state,purify,p1,p2,pproj,fmin):
+
+#   Connects two pairs in state (A, B, C, D) and, if purify is set,
+#   purifies the result up to fmin. Returns the new state and its yield
+#   factor G (nan if fmin cannot be reached).
+
+    key = roundkey(*(float(x) for x in state), purify, p1, p2, pproj, fmin)
+    out = STEPS.get(key)
+    if out is not None:
+        return out
+    A, B, C, D = connect(*state,pproj,p1,p2)
+    if not purify or A > fmin:
+        out = (A, B, C, D), 2
+    else:
+        n, G, A, B, C, D, reached = rounds(A,B,C,D,pproj,p2,fmin,star=attractor(pproj,p2))
+        out = (float(A), float(B), float(C), float(D)), float(G)
+    STEPS.put(key, out)
+    return out
+
+
+def remaining(xn,j):
+
+#   Lower bound on the expenditure of levels j..xn-1
+
+    return 2 * ((2 ** (xn - j)) - 1)
+
+
+def pareto(plans):
+
+#   Keeps the plans (expenditure, fidelity, ...) no other plan beats on
+#   both expenditure and fidelity, sorted by expenditure
+
+    front = []
+    for plan in sorted(plans, key=lambda p: (p[0], -p[1])):
+        if not front or plan[1] > front[-1][1]:
+            front.append(plan)
+    return front
+
+
+def optimize(il,NN,p1,p2,pproj,fmin,att=0.17,placement=False,slack=1.0,floor=0.5):
+
+#   Searches the nesting level (and purification placement) of a channel
+#   of length il. Returns the cheapest plan reaching fmin as
+#   (expenditure, fidelity, nesting, purified), where purified has bit j
+#   set when level j purifies, or None if no plan reaches fmin, together
+#   with the Pareto front as a structured array with the fields of FRONT.
+
+    NN = sorted(int(xn) for xn in atleast_1d(NN))
+    best = [inf, None]
+    plans = []
+
+    def finish(AP, A, xn, mask):
+        if A >= floor:
+            plans.append((AP, A, xn, mask))
+        if A >= fmin and AP < best[0]:
+            best[:] = [AP, (AP, A, xn, mask)]
+
+#   Seeds the incumbent with the purify-at-every-level plan of each
+#   nesting level, stopping a level early once it is too expensive
+    for xn in NN:
+        if remaining(xn,0) >= slack * best[0]:
+            break
+        pfib = transmission(il/(2**xn),att)
+        AP = 0
+        for j in range(xn):
+            A, B, C, D, G = level(pfib,j,p1,p2,pproj,fmin)
+            AP = AP + ((2 ** (xn - 1 - j)) * G)
+            if isnan(G) or AP + remaining(xn,j+1) >= slack * best[0]:
+                break
+        else:
+            finish(AP, A, xn, (2**xn) - 1)
+
+#   Skipping purification only lowers the fidelity, so if no plan that
+#   purifies everywhere reaches fmin there is nothing to place
+    if placement and best[1] is not None:
+        for xn in NN:
+            if remaining(xn,0) >= slack * best[0]:
+                break
+            pfib = transmission(il/(2**xn),att)
+            _search(fibre(pfib), 0, xn, 0, 0, p1, p2, pproj, fmin, slack, best, finish)
+
+    front = pareto([plan for plan in plans if plan[0] <= slack * best[0]])
+    table = zeros(len(front), dtype=FRONT)
+    table['distance'] = il
+    for k, name in enumerate(['expenditure', 'fidelity', 'nesting', 'purified']):
+        table[name] = [plan[k] for plan in front]
+    return best[1], table
+
+
+def _search(state,j,xn,AP,mask,p1,p2,pproj,fmin,slack,best,finish):
+
+#   Depth first search over purify/connect choices from level j, the
+#   purifying branch first. Plans that purify at every level were
+#   already visited when seeding.
+
+    if j == xn:
+        if mask != (2**xn) - 1:
+            finish(AP, state[0], xn, mask)
+        return
+    weight = 2 ** (xn - 1 - j)
+    for purify in (True, False):
+        new, G = step(state,purify,p1,p2,pproj,fmin)
+        if not isnan(G) and AP + (weight * G) + remaining(xn,j+1) < slack * best[0]:
+            _search(new, j+1, xn, AP + (weight * G), mask | (purify << j),
+                    p1, p2, pproj, fmin, slack, best, finish)
+#       A connection already above fmin is not purified, so both choices
+#       are the same plan
+        if G == 2:
+            break
+
+
+def optimizeall(L,NN,p1,p2,pproj,fmin,att=0.17,placement=False,slack=1.0,floor=0.5):
+
+#   Runs optimize for every distance in L. Returns the optimum table
+#   (fields of sweep.TABLE) and the concatenated Pareto fronts.
+
+    L = atleast_1d(L)
+    table = zeros(len(L), dtype=TABLE)
+    table['p1'], table['p2'], table['pproj'], table['fmin'] = p1, p2, pproj, fmin
+    table['distance'] = L
+    table['expenditure'] = nan
+    fronts = []
+    for k, il in enumerate(L):
+        plan, front = optimize(il,NN,p1,p2,pproj,fmin,att,placement,slack,floor)
+        if plan is not None:
+            table[k]['expenditure'], table[k]['nesting'] = plan[0], plan[2]
+        fronts.append(front)
+    return table, concatenate(fronts)
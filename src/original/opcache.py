@@ -0,0 +1,128 @@
+#   Registry of the fixed operators used by oxiter.py, belldiag.py,
+#   localop.py, protocol.py and qnces.py, built once and shared by every
+#   call
+
+#   Bell states and projectors and Pauli products are the same on every
+#   call of diagstate, pol1/pol2 and the Bell diagonal runs of
+#   protocol.py, and the axis bookkeeping of localop.py depends only on
+#   the register size and target qubits. (The gates and measurement
+#   projectors of ESc and QNCc are folded into the superoperators of
+#   protocol.py, which caches those itself.) Each is built on first use
+#   and kept in a single LRU cache, keyed on its kind and parameters
+#   (register size, target qubits), bounded both in entries and in total
+#   bytes so that operators on large registers cannot grow it without
+#   limit.
+
+#   Returned arrays are shared between callers and must not be modified
+#   in place.
+
+#   Parameters
+#   ---------------
+#   N - Number of qubits in the register
+#   targets - List of the qubits an operator acts on
+
+from numpy import array
+from circuits.noise import pauli_product
+from .memo import LRUCache
+
+OPERATORS = LRUCache(maxsize=1024, maxbytes=64 * 2**20)
+
+
+def _nbytes(value):
+
+#   Total size of the arrays in value
+
+    if isinstance(value, tuple):
+        return sum(_nbytes(v) for v in value)
+    return getattr(value, 'nbytes', 0)
+
+
+def cached(key, build):
+
+#   Returns the registry entry for key, calling build() to create it on
+#   the first request
+
+    value = OPERATORS.get(key)
+    if value is None:
+        value = build()
+        OPERATORS.put(key, value, _nbytes(value))
+    return value
+
+
+def bellprojectors():
+
+#   Returns the projectors onto the four Bell states, in the order of
+#   belldiag.BELL (coefficients A, B, C, D), as an array of shape (4, 4, 4)
+
+    def build():
+        from qutip import bell_state, ket2dm
+        from .belldiag import BELL
+        return array([ket2dm(bell_state(b)).full() for b in BELL])
+    return cached(('bell',), build)
+
+
+def bellkets():
+
+#   Returns the four Bell states as the rows of a 4 x 4 array, in the
+#   order of bellprojectors
+
+    def build():
+        from qutip import bell_state
+        from .belldiag import BELL
+        return array([bell_state(b).full().ravel() for b in BELL])
+    return cached(('bellket',), build)
+
+
+def paulis(labels):
+
+#   Returns the Kronecker product of the named Paulis, e.g. 'XX'
+
+    return cached(('pauli', labels), lambda: pauli_product(labels))
+
+
+def sandwichplan(N,targets):
+
+#   Returns the column axes of targets and the axes the contracted
+#   operator axes are moved back from, for localop.sandwich
+
+    targets = tuple(targets)
+
+    def build():
+        k = len(targets)
+        return (list(targets), [N + t for t in targets], list(range(k)),
+                list(range(k, 2 * k)), list(range(2 * N - k, 2 * N)))
+    return cached(('sandwich', N, targets), build)
+
+
+def twirlplan(N,targets):
+
+#   Returns the row and column axes of targets and their positions after
+#   being moved to the front, for localop.twirl
+
+    targets = tuple(targets)
+
+    def build():
+        k = len(targets)
+        return list(targets) + [N + t for t in targets], list(range(2 * k))
+    return cached(('twirl', N, targets), build)
+
+
+def ptraceplan(N,keep):
+
+#   Returns the axis order that brings the kept qubits to the front of
+#   the rows and columns, for localop.ptrace
+
+    keep = tuple(sorted(keep))
+
+    def build():
+        others = [q for q in range(N) if q not in keep]
+        return (list(keep) + others + [N + q for q in keep] + [N + q for q in others],
+                2**len(keep), 2**len(others))
+    return cached(('ptrace', N, keep), build)
+
+
+def stats():
+
+#   Reports hit/miss statistics and the size of the registry
+
+    return OPERATORS.stats()
@@ -0,0 +1,182 @@
+#   Batched evaluation of the Oxford purification and connection
+#   recurrences defined in oxiter.py
+
+#   All arguments may be floats or numpy arrays of any broadcast-compatible
+#   shape, so a whole parameter sweep can be pushed through one round in a
+#   single call while scalar callers pay no numpy overhead. The
+#   polynomials of oxiter.py are regrouped so that the sixteen pair
+#   products, the common numerator and the success probability are
+#   computed once per round instead of once per coefficient.
+
+#   Parameters
+#   ---------------
+#   A1, A2 - Coefficients of Bell basis state 00 + 11
+#   B1, B2 - Coefficients of Bell basis state 01 - 10
+#   C1, C2 - Coefficients of Bell basis state 01 + 10
+#   D1, D2 - Coefficients of Bell basis state 00 - 11
+#   p1 - Probability of a clean one qubit operation in
+#        the presence of depolarizing noise
+#   p2 - Probability of a clean two qubit operation in
+#        the presence of depolarizing noise
+#   pproj - Probability of projecting onto the correct basis
+#           state during a single qubit measurement
+#   fmin - Desired output fidelity
+
+from numpy import (asarray, broadcast_arrays, maximum, nan, nonzero, ones, stack,
+                   unique, where, zeros)
+
+
+def purify(A1,A2,B1,B2,C1,C2,D1,D2,pproj,p2):
+
+#   Performs one round of Oxford purification on two (possibly different)
+#   Bell diagonal pairs. Returns the updated coefficients (A, B, C, D) and
+#   the success probability N, matching coeffA..coeffD and pparr.
+
+    AA = A2 * A1
+    AB = A1 * B2
+    BA = A2 * B1
+    BB = B2 * B1
+    AC = A1 * C2
+    BC = B1 * C2
+    CA = A2 * C1
+    CB = B2 * C1
+    CC = C2 * C1
+    AD = A1 * D2
+    BD = B1 * D2
+    CD = C1 * D2
+    DA = A2 * D1
+    DB = B2 * D1
+    DC = C2 * D1
+    DD = D2 * D1
+
+    base = A1 + BA + BB + BC + CA + CB + CC + BD + CD + DA + DB + DC + DD
+    T = (A1 + B1 + C1 + D1) * (A2 + B2 + C2 + D2)
+    S = (AA + AB + BA + BB + CC + CD + DC + DD) \
+        - (AC + BC + CA + CB + AD + BD + DA + DB)
+    q = 16 * pproj * (1 - pproj)
+    pp = p2**2
+
+    N = (base + (pp * S * ((1 - (2 * pproj))**2))) / 2
+    norm = 8 * N
+
+    A = (base + (pp * ((8 * (AA + BB)) - T - (q * (AA + BB - CA - DB))))) / norm
+    B = (base + (pp * ((8 * (CD + DC)) - T + (q * (BC + AD - CD - DC))))) / norm
+    C = (base + (pp * ((8 * (CC + DD)) - T + (q * (AC + BD - CC - DD))))) / norm
+    D = (base + (pp * ((8 * (AB + BA)) - T - (q * (AB + BA - CB - DA))))) / norm
+
+    return A, B, C, D, N
+
+
+def purifysym(A,B,C,D,pproj,p2):
+
+#   Performs one round of Oxford purification on two copies of the same
+#   Bell diagonal pair, as done by the nesting loop in mainmodel.py
+
+    return purify(A,A,B,B,C,C,D,D,pproj,p2)
+
+
+def connect(A,B,C,D,pproj,p1,p2):
+
+#   Performs entanglement connection of two copies of the same Bell
+#   diagonal pair. Returns the coefficients (A, B, C, D) given by
+#   connA..connD, with the same grouping of terms.
+
+    sq = A**2 + B**2 + C**2 + D**2
+    AB2 = 2 * A * B
+    CD2 = 2 * C * D
+    mix = (A + B) * (C + D)
+    pc = pproj**2
+    pw = (1 - pproj)**2
+    px = pproj * (1 - pproj)
+    noise2 = (1 - p2) / 4
+    noise1 = (1 - p1) / 4
+
+    Ac = p1 * ((p2 * ((pc * sq) + (pw * (AB2 + CD2)) + (2 * px * mix))) + noise2) + noise1
+    Bc = p1 * ((p2 * ((pc * AB2) + CD2 + (pw * sq) + (2 * px * mix))) + noise2) + noise1
+    Cc = p1 * ((p2 * ((pc * 2 * A * C) + (2 * B * D) + (pw * ((2 * A * D) + (2 * B * C)))
+        + (px * (sq + AB2 + CD2)))) + noise2) + noise1
+    Dc = p1 * ((p2 * ((pc * 2 * A * D) + (2 * B * C) + (pw * ((2 * A * C) + (2 * B * D)))
+        + (px * (sq + AB2 + CD2)))) + noise2) + noise1
+
+    return Ac, Bc, Cc, Dc
+
+
+def fixedpoint(pproj,p2,tol=1e-12,maxiter=1000):
+
+#   Finds the attracting fixed point (A, B, C, D) of purifysym for the
+#   given noise by iterating from a perfect pair until the coefficients
+#   change by less than tol. Each distinct (pproj, p2) is iterated once.
+#   Entries that have not settled after maxiter rounds (noise close to
+#   the point where purification stops working) are nan.
+
+    pproj, p2 = broadcast_arrays(asarray(pproj, dtype=float), asarray(p2, dtype=float))
+    pairs, inverse = unique(stack([pproj.ravel(), p2.ravel()]), axis=1, return_inverse=True)
+    m = pairs.shape[1]
+    X = [ones(m), zeros(m), zeros(m), zeros(m)]
+    active = ones(m, dtype=bool)
+    for i in range(maxiter):
+        idx = nonzero(active)
+        if len(idx[0]) == 0:
+            break
+        Y = purifysym(X[0][idx],X[1][idx],X[2][idx],X[3][idx],pairs[0][idx],pairs[1][idx])[:4]
+        step = zeros(len(idx[0]))
+        for x, y in zip(X, Y):
+            step = maximum(step, abs(y - x[idx]))
+            x[idx] = y
+        active[idx] = step >= tol
+    inverse = inverse.ravel()
+    return tuple(where(active, nan, x)[inverse].reshape(pproj.shape) for x in X)
+
+
+def rounds(A,B,C,D,pproj,p2,fmin,maxiter=1000,star=None):
+
+#   Calculates how many rounds of purifysym bring A up to at least fmin.
+#   Returns the number of rounds n, the yield factor G (the product of
+#   2/N over the rounds), the final coefficients (A, B, C, D) and whether
+#   fmin was reached. Unreachable entries have n = -1 and G = nan.
+
+#   The fixed point of the noisy map is found up front. An entry is
+#   abandoned as soon as its state is within (fmin - A*)/4 of a settled
+#   fixed point A* that lies below fmin, or it becomes separable (every
+#   coefficient at most 1/2), from where purification cannot pass 1/2.
+#   Entries still short of fmin after maxiter rounds are also marked
+#   unreachable. A fixed point already found with fixedpoint can be
+#   passed as star to skip that step.
+
+    A, B, C, D, pproj, p2, fmin = broadcast_arrays(*(asarray(x, dtype=float)
+        for x in (A, B, C, D, pproj, p2, fmin)))
+    shape = A.shape
+    if star is None:
+        star = fixedpoint(pproj,p2)
+    Astar, Bstar, Cstar, Dstar = (x.ravel() for x in broadcast_arrays(*star, A)[:4])
+    A, B, C, D, pproj, p2, fmin = (x.ravel() for x in (A, B, C, D, pproj, p2, fmin))
+    A, B, C, D = A.copy(), B.copy(), C.copy(), D.copy()
+    n = zeros(A.shape, dtype=int)
+    G = ones(A.shape)
+    margin = (fmin - Astar) / 4
+
+    reached = A >= fmin
+    failed = zeros(A.shape, dtype=bool)
+    active = ~reached
+    for i in range(maxiter):
+        idx = nonzero(active)
+        if len(idx[0]) == 0:
+            break
+        a, b, c, d, N = purifysym(A[idx],B[idx],C[idx],D[idx],pproj[idx],p2[idx])
+        A[idx], B[idx], C[idx], D[idx] = a, b, c, d
+        n[idx] = n[idx] + 1
+        G[idx] = G[idx] * (2/N)
+
+        done = a >= fmin[idx]
+        dist = maximum(maximum(abs(a - Astar[idx]), abs(b - Bstar[idx])),
+                       maximum(abs(c - Cstar[idx]), abs(d - Dstar[idx])))
+        stuck = (margin[idx] > 0) & (dist < margin[idx])
+        separable = (maximum(maximum(a, b), maximum(c, d)) <= 0.5) & (fmin[idx] > 0.5)
+        reached[idx] = done
+        failed[idx] = ~done & (stuck | separable)
+        active[idx] = ~(done | stuck | separable)
+
+    failed = failed | active
+    n[failed] = -1
+    G[failed] = nan
+    return tuple(x.reshape(shape) for x in (n, G, A, B, C, D, reached))
@@ -22,14 +22,16 @@
 #   "Quantum communication over long distances
 #   using quantum repeaters"
             
-from qutip import ket2dm, bell_state
+from .opcache import bellprojectors
 
 def diagstate(A,B,C,D):
      
-#   Generates a state diagonalized is the Bell basis
+#   Generates a state diagonalized is the Bell basis, from the shared
+#   Bell projectors of opcache.py
    
-    dstate = (A * ket2dm(bell_state())) + (B * ket2dm(bell_state('11'))) \
-    + (C * ket2dm(bell_state('10'))) + (D * ket2dm(bell_state('01')))
+    from qutip import Qobj
+    P = bellprojectors()
+    dstate = Qobj((A * P[0]) + (B * P[1]) + (C * P[2]) + (D * P[3]), dims=[[2,2],[2,2]])
    
     if round(A + B + C + D, 4) != 1:
        raise ValueError("Sum of coefficients must be 1")
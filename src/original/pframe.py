@@ -0,0 +1,290 @@
+#   Monte Carlo Pauli frame simulation of measurement based protocols on
+#   registers of Bell pairs
+
+#   The protocols of circuits/repeater.py only use Clifford gates (cnot,
+#   snot, cz, Paulis, phase), Pauli noise and Z basis measurements, so a
+#   shot is fully described by the Pauli error (its frame, one X and one
+#   Z bit per qubit) relative to the noiseless run. Frames of 64 shots
+#   are packed into each uint64 word and propagated through the gates
+#   with bitwise operations, so the cost grows linearly with the number
+#   of qubits instead of as 4^N.
+
+#   A measurement whose frame has its X bit set (or whose readout is
+#   flipped) reports the wrong outcome. The Pauli this costs the kept
+#   pair is found once per protocol from the stabilizers X X and Z Z of
+#   the initial Bell pairs, propagated through the noiseless circuit: a
+#   combination of them that flips only that measurement is equivalent
+#   to doing nothing, so flipping the outcome is the same as applying the
+#   rest of that combination to the kept qubits. The outcome of each
+#   shot is the Bell state of the kept pair, from which the fidelity and
+#   its Wilson confidence interval are estimated.
+
+#   The noise model differs from the density matrix model of qnces.py in
+#   two ways:
+#   - pol1/pol2 skip the gate in the noise branch (p G rho G + (1 - p)/3
+#     sum P rho P). Skipping a Clifford gate is not a Pauli error, so
+#     here the gate is always applied and followed by a Pauli error with
+#     probability 1 - p (every non-identity Pauli on one qubit, or the 12
+#     Paulis of pol2 on two qubits). This is the usual depolarizing model.
+#   - A faulty measurement reports the wrong outcome with probability
+#     1 - pproj, as in oxiter.py, rather than applying the unnormalised
+#     projector et|0><0| + (1 - et)|1><1| of ESc.
+#   With p1 = p2 = pproj = 1 both models agree exactly.
+
+#   Parameters
+#   ---------------
+#   protocol - Dictionary with "pairs", "keep" and "circuit", see
+#              circuits/repeater.py
+#   A, B, C, D - Bell coefficients of every input pair
+#   shots - Number of Monte Carlo shots
+#   confidence - Confidence level of the Wilson interval
+#   seed - Seed of the random generator
+#   params - Values of the noise parameters named in the protocol
+
+from statistics import NormalDist
+from numpy import (allclose, array, asarray, cumsum, full, packbits, searchsorted, sqrt,
+                   uint8, uint64, unpackbits, zeros)
+from numpy.random import default_rng
+from circuits.noise import NOISE1, NOISE2, PAULIS
+from .protocol import steps
+
+BATCH = 2**20
+
+H = array([[1, 1], [1, -1]], dtype=complex) / sqrt(2)
+CLIFFORDS = {
+    'i': PAULIS['I'], 'x': PAULIS['X'], 'y': PAULIS['Y'], 'z': PAULIS['Z'],
+    'h': H, 's': array([[1, 0], [0, 1j]]), 'sdg': array([[1, 0], [0, -1j]]),
+    'cnot': array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]], dtype=complex),
+    'cz': array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, -1]], dtype=complex),
+}
+
+#   Frame of the second qubit of a pair in each Bell state, in the order
+#   A, B, C, D (see belldiag.FLIP): identity, Y, X, Z as (x, z) bits
+BELLFRAME = [(0, 0), (1, 1), (1, 0), (0, 1)]
+
+
+def clifford(matrix):
+
+#   Names a one or two qubit Clifford gate supported by the frame
+#   propagation, matching up to a global phase
+
+    for name, C in CLIFFORDS.items():
+        if C.shape == matrix.shape:
+            k = (C.conj().T @ matrix)[0, 0]
+            if abs(abs(k) - 1) < 1e-9 and allclose(matrix, k * C):
+                return name
+    raise ValueError("Gate is not a supported Clifford gate:\n%s" % matrix)
+
+
+def propagate(X,Z,name,targets):
+
+#   Conjugates the frames X, Z (one row per qubit) by a Clifford gate, in
+#   place. Works on packed words and on boolean arrays alike.
+
+    if name == 'h':
+        q = targets[0]
+        X[q], Z[q] = Z[q].copy(), X[q].copy()
+    elif name in ('s', 'sdg'):
+        q = targets[0]
+        Z[q] ^= X[q]
+    elif name == 'cnot':
+        c, t = targets
+        X[t] ^= X[c]
+        Z[c] ^= Z[t]
+    elif name == 'cz':
+        a, b = targets
+        Z[a] ^= X[b]
+        Z[b] ^= X[a]
+
+
+def _solve(M,b):
+
+#   Solves c M = b over GF(2), returning c or None
+
+    M = asarray(M, dtype=uint8) % 2
+    rows, cols = M.shape
+    A = zeros((cols, rows + 1), dtype=uint8)
+    A[:, :rows] = M.T
+    A[:, rows] = b
+    pivots = []
+    r = 0
+    for col in range(rows):
+        hit = [i for i in range(r, cols) if A[i, col]]
+        if not hit:
+            continue
+        A[[r, hit[0]]] = A[[hit[0], r]]
+        for i in range(cols):
+            if i != r and A[i, col]:
+                A[i] ^= A[r]
+        pivots.append(col)
+        r = r + 1
+    if A[r:, rows].any():
+        return None
+    c = zeros(rows, dtype=uint8)
+    for i, col in enumerate(pivots):
+        c[col] = A[i, rows]
+    return c
+
+
+def wilson(successes,shots,confidence=0.95):
+
+#   Wilson score interval of a binomial proportion
+
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    f = successes / shots
+    centre = (f + (z * z / (2 * shots))) / (1 + (z * z / shots))
+    half = (z / (1 + (z * z / shots))) * sqrt((f * (1 - f) / shots) + (z * z / (4 * shots * shots)))
+    return centre - half, centre + half
+
+
+class FrameSim:
+
+#   Protocol compiled for Pauli frame sampling
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.pairs = protocol["pairs"]
+        self.keep = sorted(protocol["keep"])
+        if len(self.keep) != 2:
+            raise ValueError("Pauli frame estimates need exactly two kept qubits")
+        flat, ops = steps(protocol)
+        self.program = []
+        for step in flat:
+            kind, matrix, name, k = ops[step[1]]
+            targets = list(step[2:])
+            gate = 'measure' if kind == 'measure' else clifford(matrix)
+            self.program.append((gate, targets, name, k))
+        self.names = sorted({op[2] for op in self.program if op[2] is not None})
+        self.byproducts = self._byproducts()
+
+    def _byproducts(self):
+
+#       Propagates the stabilizers X X and Z Z of every input pair through
+#       the noiseless circuit and solves for the Pauli (x_a, z_a, x_b, z_b)
+#       on the kept qubits that each flipped measurement amounts to
+
+        n = 2 * self.pairs
+        G = 2 * self.pairs
+        X = zeros((n, G), dtype=bool)
+        Z = zeros((n, G), dtype=bool)
+        for k in range(self.pairs):
+            X[2 * k, 2 * k] = X[(2 * k) + 1, 2 * k] = True
+            Z[2 * k, (2 * k) + 1] = Z[(2 * k) + 1, (2 * k) + 1] = True
+        flips = []
+        for gate, targets, _, _ in self.program:
+            if gate == 'measure':
+                flips.append(X[targets[0]].copy())
+            else:
+                propagate(X,Z,gate,targets)
+        a, b = self.keep
+        final = array([X[a], Z[a], X[b], Z[b]]).T
+        M = array(flips).T if flips else zeros((G, 0), dtype=bool)
+
+        for pauli in ([1, 0, 1, 0], [0, 1, 0, 1]):
+            ext = array([list(row) + list(f) for row, f in zip(M, final)])
+            if _solve(ext, [0] * M.shape[1] + pauli) is None:
+                raise ValueError("Protocol does not leave a Bell pair on %s" % self.keep)
+
+        out = []
+        for i in range(M.shape[1]):
+            e = zeros(M.shape[1], dtype=uint8)
+            e[i] = 1
+            c = _solve(M, e)
+            if c is None:
+                raise ValueError("Measurement %d has a deterministic outcome" % i)
+            out.append((c.astype(int) @ final.astype(int)) % 2)
+        return out
+
+    def _bits(self, rng, prob, shots, words):
+
+#       Packs shots Bernoulli(prob) samples into words uint64 words
+
+        bits = rng.random(words * 64) < prob
+        bits[shots:] = False
+        return packbits(bits, bitorder='little').view(uint64)
+
+    def _batch(self, coeffs, params, shots, rng):
+
+#       Samples one batch of shots, returning the count of every Bell
+#       state of the kept pair in the order A, B, C, D
+
+        words = -(-shots // 64)
+        n = 2 * self.pairs
+        X = zeros((n, words), dtype=uint64)
+        Z = zeros((n, words), dtype=uint64)
+        cdf = cumsum(coeffs)
+        for k in range(self.pairs):
+            label = searchsorted(cdf / cdf[-1], rng.random(words * 64), side='right')
+            label[shots:] = 0
+            for bit, M in ((0, X), (1, Z)):
+                hit = array([f[bit] for f in BELLFRAME], dtype=bool)[label.clip(0, 3)]
+                M[(2 * k) + 1] = packbits(hit, bitorder='little').view(uint64)
+
+        flipped = []
+        for gate, targets, name, k in self.program:
+            if gate == 'measure':
+                e = X[targets[0]].copy()
+                if name is not None:
+                    e ^= self._bits(rng, 1 - params[name], shots, words)
+                flipped.append(e)
+                continue
+            propagate(X,Z,gate,targets)
+            if name is None:
+                continue
+            p = params[name]
+            noise = NOISE1 if k == 1 else NOISE2
+            u = rng.random(words * 64)
+            which = full(words * 64, -1)
+            if p < 1:
+                which = ((u - p) * len(noise) / (1 - p)).astype(int)
+                which[(u < p) | (which >= len(noise))] = -1
+            which[shots:] = -1
+            for j, P in enumerate(noise):
+                hit = packbits(which == j, bitorder='little').view(uint64)
+                for q, label in zip(targets, P):
+                    if label in 'XY':
+                        X[q] ^= hit
+                    if label in 'ZY':
+                        Z[q] ^= hit
+
+        a, b = self.keep
+        out = [X[a] ^ X[b], Z[a] ^ Z[b]]
+        for e, (xa, za, xb, zb) in zip(flipped, self.byproducts):
+            if xa ^ xb:
+                out[0] = out[0] ^ e
+            if za ^ zb:
+                out[1] = out[1] ^ e
+        x, z = out
+        valid = self._bits(rng, 1, shots, words)
+        counts = []
+        for fx, fz in BELLFRAME:
+            mask = (x if fx else ~x) & (z if fz else ~z) & valid
+            counts.append(int(unpackbits(mask.view(uint8)).sum()))
+        return counts
+
+    def run(self, A, B, C, D, shots=100000, confidence=0.95, seed=None, **params):
+
+#       Estimates the Bell coefficients of the kept pair, returning the
+#       fidelity (weight of 00 + 11), its Wilson interval and the
+#       estimated (A, B, C, D)
+
+        missing = [name for name in self.names if name not in params]
+        if missing:
+            raise ValueError("Missing noise parameters %s" % missing)
+        rng = default_rng(seed)
+        counts = [0, 0, 0, 0]
+        done = 0
+        while done < shots:
+            size = min(BATCH, shots - done)
+            counts = [c + d for c, d in zip(counts, self._batch([A, B, C, D], params, size, rng))]
+            done = done + size
+        low, high = wilson(counts[0], shots, confidence)
+        return {'fidelity': counts[0] / shots, 'low': low, 'high': high, 'shots': shots,
+                'coefficients': tuple(c / shots for c in counts)}
+
+
+def estimate(protocol, A, B, C, D, shots=100000, confidence=0.95, seed=None, **params):
+
+#   Compiles a protocol and estimates its output fidelity
+
+    return FrameSim(protocol).run(A, B, C, D, shots, confidence, seed, **params)
@@ -0,0 +1,297 @@
+#   Simulator for measurement based protocols on a register of Bell pairs,
+#   described in the stage format of circuits/repeater.py
+
+#   compile_protocol reads a protocol once: the steps are scheduled with
+#   schedule.py (pairs join when first used, qubits that are not kept are
+#   traced out after their last use), and runs of consecutive events
+#   acting on at most two qubits of the working register are fused into
+#   a single superoperator. A fused group may end by tracing out one of
+#   its qubits, in which case the trace is folded into the superoperator
+#   too. Each group is then one contraction with the register instead of
+#   a gate, the noise terms, a projector and a partial trace applied one
+#   after another.
+
+#   Superoperators depend on the noise parameters, so they are built per
+#   parameter set when the compiled protocol is run and cached on the
+#   rounded parameter values.
+
+#   When the pairs are Bell diagonal (a BellDiag pair, or a 4 x 4 matrix
+#   that is diagonal in the Bell basis) the output is linear in the
+#   weights of each pair, so it is the sum over label combinations of
+#   the output for pure Bell pairs times the product of their weights.
+#   Compiled.response tabulates those outputs once per parameter set, by
+#   running the program on a batch holding one register per combination,
+#   and a run becomes a contraction of the table with the pair
+#   coefficients. The table grows fourfold with every pair, so protocols
+#   whose batch would exceed RESPONSE entries (QNC) always run dense.
+
+#   Runs are recorded by func/instrument.py as 'pair' (a Bell pair joins
+#   the register), 'group' (a fused group is applied, including any trace
+#   folded into it), 'ptrace' (the final reduction to the kept qubits)
+#   and 'bell' (the contraction with a response table).
+
+#   Noisy gates follow pol1/pol2 of qnces.py, with the clean branch
+#   G rho G^dagger (pol1/pol2 apply G rho G, which is the same for the
+#   Hermitian gates cnot and snot). Faulty measurements apply
+#   et|0><0| + (1 - et)|1><1| on both sides and multiply by 2, as in ESc.
+
+#   Parameters
+#   ---------------
+#   protocol - Dictionary with "pairs", "keep" and "circuit" (list of
+#              stage dictionaries), see circuits/repeater.py
+#   wf - 4 x 4 density matrix of each Bell pair, or a one pair BellDiag
+#   params - Values of the noise parameters named in the protocol,
+#            e.g. p1, p2, pproj
+#   width - Largest number of qubits a fused group may act on
+
+from numpy import asarray, einsum, eye, kron, moveaxis, ones, stack, trace
+from circuits.noise import NOISE1, NOISE2, pauli_product
+from func.instrument import section
+from .belldiag import BellDiag
+from .localop import permute, ptrace
+from .memo import LRUCache, roundkey
+from .opcache import bellprojectors
+from .schedule import plan
+
+#   Largest batch, in matrix entries, for which a response table is built
+RESPONSE = 2**20
+
+
+def _terms(op,params):
+
+#   Lists the (weight, left, right) sandwiches making up one step
+
+    kind, matrix, name, k = op
+    if kind == 'measure':
+        et = 1 if name is None else params[name]
+        M = asarray([[et, 0], [0, 1 - et]], dtype=complex)
+        return [(2, M, M)]
+    terms = [(1 if name is None else params[name], matrix, matrix.conj().T)]
+    if name is not None:
+        p = params[name]
+        noise = NOISE1 if k == 1 else NOISE2
+        terms.extend(((1 - p) / len(noise), pauli_product(P), pauli_product(P)) for P in noise)
+    return terms
+
+
+def _embed(M,targets,group):
+
+#   Extends an operator on targets to the qubits of group, in group order
+
+    rest = [q for q in group if q not in targets]
+    M = kron(M, eye(2**len(rest)))
+    n = len(group)
+    order = list(targets) + rest
+    return permute(M, [order.index(q) for q in group], n)
+
+
+def _superop(members,group,traced,params):
+
+#   Builds the superoperator of a fused group as a matrix acting on the
+#   row-major vectorised density matrix of the group qubits
+
+    d = 2**len(group)
+    S = eye(d * d, dtype=complex)
+    for op, targets in members:
+        step = 0
+        for weight, L, R in _terms(op,params):
+            L = _embed(L,targets,group)
+            R = _embed(R,targets,group)
+            step = step + (weight * kron(L, R.T))
+        S = step @ S
+    if traced is not None:
+        k = len(group)
+        q = group.index(traced)
+        S = S.reshape((2,) * (2 * k) + (d * d,))
+        S = trace(S, axis1=q, axis2=k + q)
+        S = S.reshape(4**(k - 1), d * d)
+    return S
+
+
+def _apply(rho,S,group,traced,N):
+
+#   Applies a group superoperator to the register rho of N qubits
+
+    k = len(group)
+    axes = list(group) + [N + q for q in group]
+    T = moveaxis(rho.reshape((2,) * (2 * N)), axes, list(range(2 * k)))
+    rest = T.shape[2 * k:]
+    T = (S @ T.reshape(4**k, -1))
+    if traced is None:
+        out = list(group)
+        n = N
+    else:
+        n = N - 1
+        out = [q - (q > traced) for q in group if q != traced]
+    T = T.reshape((2,) * (2 * len(out)) + rest)
+    T = moveaxis(T, list(range(2 * len(out))), out + [n + q for q in out])
+    return T.reshape(2**n, 2**n), n
+
+
+def steps(protocol):
+
+#   Flattens the stages of a protocol into schedule.py steps and the
+#   table of operations they refer to
+
+    ops = []
+    out = []
+    for stage in protocol["circuit"]:
+        for operation in stage["operations"]:
+            gate, targets = operation[0], list(operation[1])
+            name = operation[2] if len(operation) > 2 else None
+            if isinstance(gate, str):
+                if gate != 'measure' or len(targets) != 1:
+                    raise ValueError("Unknown operation %s on %s" % (gate, targets))
+                ops.append(('measure', None, name, 1))
+            else:
+                matrix = gate.full() if hasattr(gate, 'full') else asarray(gate, dtype=complex)
+                if matrix.shape != (2**len(targets),) * 2:
+                    raise ValueError("Gate does not match targets %s" % targets)
+                if name is not None and len(targets) > 2:
+                    raise ValueError("Depolarizing noise is defined for one and two qubit gates only")
+                ops.append(('gate', matrix, name, len(targets)))
+            out.append(('op', len(ops) - 1) + tuple(targets))
+    return out, ops
+
+
+class Compiled:
+
+#   Protocol compiled into a list of pair insertions, fused groups and a
+#   final reduction to the kept qubits
+
+    def __init__(self, protocol, width=2):
+        self.protocol = protocol
+        flat, self.ops = steps(protocol)
+        events, self.peak = plan(flat, protocol["pairs"], protocol["keep"])
+        self.names = sorted({op[2] for op in self.ops if op[2] is not None})
+        self.program = []
+        group = None
+        for event in events:
+            kind = event[0]
+            if kind == 'op':
+                targets = list(event[2:])
+                union = targets if group is None else \
+                    group[0] + [q for q in targets if q not in group[0]]
+                if group is not None and len(union) <= width:
+                    group[0][:] = union
+                    group[1].append((self.ops[event[1]], targets))
+                    continue
+                self._close(group)
+                group = (list(targets), [(self.ops[event[1]], targets)])
+            elif kind == 'trace':
+                if group is not None and event[1] in group[0]:
+                    self._close(group, event[1])
+                else:
+                    self._close(group)
+                    self._close(([event[1]], []), event[1])
+                group = None
+            else:
+                self._close(group)
+                group = None
+                self.program.append(event)
+        self.cache = LRUCache(64)
+        self.responses = LRUCache(64)
+
+#       Order in which the pairs join, and the largest batch a response
+#       table passes through
+        self.joined = [event[1] for event in self.program if event[0] == 'pair']
+        self.size = N = joined = 0
+        for event in self.program:
+            if event[0] == 'pair':
+                N, joined = N + 2, joined + 1
+            elif event[0] == 'group':
+                N = N - (event[3] is not None)
+            else:
+                N = len(event[1])
+            self.size = max(self.size, 4**joined * 4**N)
+
+    def _close(self, group, traced=None):
+        if group is not None:
+            self.program.append(('group', group[0], group[1], traced))
+
+    def superops(self, params):
+
+#       Returns the superoperator of every fused group for one parameter
+#       set, built once per distinct set
+
+        key = roundkey(*[float(params[name]) for name in self.names])
+        out = self.cache.get(key)
+        if out is None:
+            out = [_superop(event[2], event[1], event[3], params)
+                   for event in self.program if event[0] == 'group']
+            self.cache.put(key, out)
+        return out
+
+    def _execute(self, states, params):
+
+#       Runs the program on a batch of registers, joining every pair in
+#       each of the states (array of shape (s, 4, 4)) in turn, so that the
+#       batch grows s-fold per pair. Returns the batch of outputs, the
+#       states of the first pair to join varying slowest.
+
+        supers = iter(self.superops(params))
+        rho = ones((1, 1, 1), dtype=complex)
+        N = 0
+        for event in self.program:
+            if event[0] == 'pair':
+                with section('pair'):
+                    d = 4 * rho.shape[1]
+                    rho = einsum('bij,skl->bsikjl', rho, states).reshape(-1, d, d)
+                N = N + 2
+            elif event[0] == 'group':
+                S = next(supers)
+                with section('group'):
+                    rho = stack([_apply(r, S, event[1], event[3], N)[0] for r in rho])
+                N = N - (event[3] is not None)
+            else:
+                order = event[1]
+                index = [sorted(order).index(q) for q in order]
+                with section('ptrace'):
+                    rho = stack([permute(ptrace(r, order, N), index, len(order)) for r in rho])
+        return rho
+
+    def response(self, params):
+
+#       Returns the output of the protocol when the k-th pair to join is
+#       in the Bell state l_k, for every combination of labels, as an
+#       array of shape (4,)*pairs + (d, d). Built once per distinct
+#       parameter set, and None when the batch exceeds RESPONSE entries.
+
+        if self.size > RESPONSE:
+            return None
+        key = roundkey(*[float(params[name]) for name in self.names])
+        out = self.responses.get(key)
+        if out is None:
+            out = self._execute(bellprojectors(), params)
+            out = out.reshape((4,) * len(self.joined) + out.shape[1:])
+            self.responses.put(key, out)
+        return out
+
+    def run(self, wf, **params):
+
+#       Runs the protocol on copies of the pair state wf and returns the
+#       density matrix of the kept qubits, in ascending qubit order
+
+        missing = [name for name in self.names if name not in params]
+        if missing:
+            raise ValueError("Missing noise parameters %s" % missing)
+        if self.size <= RESPONSE:
+            pair = wf if isinstance(wf, BellDiag) else BellDiag.fromdense(wf)
+            if pair is not None:
+                out = self.response(params)
+                d = out.shape[-1]
+                with section('bell'):
+                    for _ in self.joined:
+                        out = pair.weights @ out.reshape(4, -1)
+                return out.reshape(d, d)
+        if isinstance(wf, BellDiag):
+            wf = wf.array()
+        wf = wf.full() if hasattr(wf, 'full') else asarray(wf)
+        return self._execute(wf[None], params)[0]
+
+
+def compile_protocol(protocol, width=2):
+
+#   Compiles a protocol for repeated runs
+
+    return Compiled(protocol, width)
@@ -21,106 +21,130 @@
 #   Results taken from "Analysis of Measurement-based Quantum Network Coding
 #   over Repeater Networks under Noisy Conditions"
 
-from qutip import *
-from oxiter import diagstate
+from qutip import Qobj, bell_state, fidelity
+from .oxiter import diagstate
+from numpy import asarray
+from .belldiag import BellDiag, bdpol1, bdpol2
+from .localop import sandwich, twirl
+from .opcache import paulis
+from .protocol import compile_protocol
+from func.instrument import instrumented, section
+from circuits.repeater import es_protocol, qnc_protocol
 
+#   pol1 and pol2 also accept a BellDiag register, and dense registers
+#   that are diagonal in the Bell basis of their pairs are recognised as
+#   one. On those the noise terms are applied as relabellings of the Bell
+#   weights, and so is the gate when it is a Pauli product (see
+#   belldiag.py). The result has the type of the input register, except
+#   that a BellDiag register comes back as a Qobj when the gate is not a
+#   Pauli product. Recognising a dense register takes a change to the
+#   Bell basis, about as costly as the dense channel itself, so the
+#   saving is for callers that keep their registers as BellDiag.
+
+#   Dense registers may be a Qobj or a 2^N x 2^N numpy array (a Qobj in
+#   gives a Qobj out). Gates and noise terms are applied to
+#   their target qubits only, using localop.py, so no operator on the
+#   full register is ever built.
+
+#   The Pauli products of pol2 are shared through the registry in
+#   opcache.py rather than rebuilt on every call.
+
+#   Gate application, noise terms, fidelity and the pair, group and ptrace
+#   steps of protocol.py are recorded by func/instrument.py when
+#   instrumentation is switched on.
+
+def _like(out,qob):
+
+#   Returns the result of pol1/pol2 in the form of the input register
+
+    if isinstance(qob, BellDiag):
+        return out if isinstance(out, BellDiag) else Qobj(out, dims=[[2]*qob.N, [2]*qob.N])
+    if isinstance(out, BellDiag):
+        out = out.array()
+    return Qobj(out, dims=qob.dims) if isinstance(qob, Qobj) else out
+
+@instrumented('pol1')
 def pol1(qob,gate,N,t,p):
-    X = gate_expand_1toN(sigmax(),N,t)
-    Y = gate_expand_1toN(sigmay(),N,t)
-    Z = gate_expand_1toN(sigmaz(),N,t)
-    G = gate_expand_1toN(gate,N,t)
-    
-    polar1 = (p*(G*qob*G)) + (((1-p)/3) * ((X*qob*X) + (Y*qob*Y) + (Z*qob*Z)))
+    rho = None if isinstance(qob, BellDiag) else (qob.full() if isinstance(qob, Qobj) else qob)
+    bd = qob if rho is None else BellDiag.fromdense(rho)
+    if bd is not None:
+        return _like(bdpol1(bd,gate,t,p,rho),qob)
+    return _like(_pol1(rho,gate,N,t,p),qob)
+
+def _pol1(qob,gate,N,t,p):
+
+#   pol1 on a numpy density matrix, kept out of the instrumented wrapper
+#   so a Qobj call is recorded once
+
+    G = gate.full() if isinstance(gate, Qobj) else asarray(gate)
+
+    with section('gate'):
+        gated = sandwich(qob,G,G,[t],N)
+    with section('noise'):
+        noise = twirl(qob,[t],N) - qob
+    polar1 = (p*gated) + (((1-p)/3) * noise)
     return polar1
 
+@instrumented('pol2')
 def pol2(qob,gate,N,c,t,p):
-    XY = gate_expand_2toN(tensor([sigmax(),sigmay()]),N,c,t)
-    XZ = gate_expand_2toN(tensor([sigmax(),sigmaz()]),N,c,t)
-    YX = gate_expand_2toN(tensor([sigmay(),sigmax()]),N,c,t)
-    YZ = gate_expand_2toN(tensor([sigmay(),sigmaz()]),N,c,t)
-    ZX = gate_expand_2toN(tensor([sigmaz(),sigmax()]),N,c,t)
-    ZY = gate_expand_2toN(tensor([sigmaz(),sigmay()]),N,c,t)
-    X1 = gate_expand_1toN(sigmax(),N,t)
-    Y1 = gate_expand_1toN(sigmay(),N,t)
-    Z1 = gate_expand_1toN(sigmaz(),N,t)
-    X2 = gate_expand_1toN(sigmax(),N,c)
-    Y2 = gate_expand_1toN(sigmay(),N,c)
-    Z2 = gate_expand_1toN(sigmaz(),N,c)
-    G = gate_expand_2toN(gate,N,c,t)
-
-    polar2 = ((p)*(G*qob*G)) + (((1-p)/12) * ((X1*qob*X1) + (Y1*qob*Y1) \
-    + (Z1*qob*Z1) + (X2*qob*X2) + (Y2*qob*Y2) + (Z2*qob*Z2) + (XY*qob*XY) \
-    + (YX*qob*YX) + (ZX*qob*ZX) + (XZ*qob*XZ) + (YZ*qob*YZ) + (ZY*qob*ZY)))
+    rho = None if isinstance(qob, BellDiag) else (qob.full() if isinstance(qob, Qobj) else qob)
+    bd = qob if rho is None else BellDiag.fromdense(rho)
+    if bd is not None:
+        return _like(bdpol2(bd,gate,c,t,p,rho),qob)
+    return _like(_pol2(rho,gate,N,c,t,p),qob)
+
+def _pol2(qob,gate,N,c,t,p):
+
+#   pol2 on a numpy density matrix, see _pol1
+
+    G = gate.full() if isinstance(gate, Qobj) else asarray(gate)
+    XX = paulis('XX')
+    YY = paulis('YY')
+    ZZ = paulis('ZZ')
+
+    with section('gate'):
+        gated = sandwich(qob,G,G,[c,t],N)
+
+#   The twelve noise terms are every two qubit Pauli except II, XX, YY
+#   and ZZ, so they are taken as the full twirl minus those four
+    with section('noise'):
+        noise = twirl(qob,[c,t],N) - qob - sandwich(qob,XX,XX,[c,t],N) \
+        - sandwich(qob,YY,YY,[c,t],N) - sandwich(qob,ZZ,ZZ,[c,t],N)
+    polar2 = ((p)*gated) + (((1-p)/12) * noise)
     return polar2
 
+#   ESc and QNCc are the ES and QNC protocols of circuits/repeater.py,
+#   compiled once by protocol.py. Measured qubits are traced out right
+#   after their last use, so the working register of QNCc peaks at 10
+#   qubits instead of 14, and consecutive steps on the same one or two
+#   qubits are fused into a single superoperator. ES on Bell diagonal
+#   pairs is small enough for protocol.py to tabulate its response per
+#   parameter set, so ESc passes its pair as a BellDiag and, after the
+#   first call with given p1, p2 and et, only weighs that table. QNCc
+#   runs on the dense register.
+ESPROTOCOL = compile_protocol(es_protocol)
+QNCPROTOCOL = compile_protocol(qnc_protocol)
+
 def ESc(p1,p2,et,A,B,C,D):
     
-    ket0 = Qobj([[1],[0]])
-    ket1 = Qobj([[0],[1]])  
-    prjk = (et*ket0.proj()) + ((1 - et)*ket1.proj())
-    
-    wf = diagstate(A,B,C,D)
-    inpt = tensor([wf,wf,wf])
-
-    inpt = pol2(inpt,cnot(),6,4,3,p2)
-    inpt = gate_expand_1toN(prjk,6,3)*inpt*gate_expand_1toN(prjk,6,3)*2
-    inpt = pol2(inpt,cnot(),6,2,1,p2)
-    inpt = gate_expand_1toN(prjk,6,1)*inpt*gate_expand_1toN(prjk,6,1)*2
-    inpt = pol1(inpt,snot(),6,2,p1)
-    inpt = gate_expand_1toN(prjk,6,2)*inpt*gate_expand_1toN(prjk,6,2)*2
-    inpt = pol1(inpt,snot(),6,4,p1)
-    inpt = gate_expand_1toN(prjk,6,4)*inpt*gate_expand_1toN(prjk,6,4)*2
+    with section('register'):
+        if round(A + B + C + D, 4) != 1:
+            raise ValueError("Sum of coefficients must be 1")
+        wf = BellDiag([A,B,C,D])
     
-    kq = inpt.ptrace([0,5])
-    q = fidelity(kq,bell_state())**2
+    kq = ESPROTOCOL.run(wf,p1=p1,p2=p2,pproj=et)
+#   Squared fidelity with the pure state 00 + 11, as fidelity(kq,
+#   bell_state())**2 gives, without building a Qobj
+    with section('fidelity'):
+        q = (kq[0,0] + kq[0,3] + kq[3,0] + kq[3,3]).real / 2
     return q
 
 def QNCc(p1,p2,et,A,B,C,D):
     
-    ket0 = Qobj([[1],[0]])
-    ket1 = Qobj([[0],[1]])  
-    prjk = (et*ket0.proj()) + ((1 - et)*ket1.proj())
-    
-    ket0 = Qobj([[1],[0]])
-    wf = diagstate(A,B,C,D)
-    inpt = tensor([wf,wf,wf,wf,wf,wf,wf])
-    
-    inpt = pol2(inpt,cnot(),14,13,11,p2)
-    inpt = pol2(inpt,cnot(),14,9,7,p2)
-    
-    inpt = gate_expand_1toN(prjk,14,11)*inpt*gate_expand_1toN(prjk,14,11)*2
-    inpt = gate_expand_1toN(prjk,14,7)*inpt*gate_expand_1toN(prjk,14,7)*2
-    
-    inpt = pol2(inpt,cnot(),14,10,5,p2)
-    inpt = pol2(inpt,cnot(),14,6,5,p2)
-    
-    inpt = gate_expand_1toN(prjk,14,5)*inpt*gate_expand_1toN(prjk,14,5)*2
-    inpt = pol2(inpt,cnot(),14,4,3,p2)
-    
-    inpt = pol2(inpt,cnot(),14,4,1,p2)
-    inpt = gate_expand_1toN(prjk,14,3)*inpt*gate_expand_1toN(prjk,14,3)*2
-    
-    inpt = gate_expand_1toN(prjk,14,1)*inpt*gate_expand_1toN(prjk,14,1)*2
-    inpt = pol2(inpt,cnot(),14,2,12,p2)
+    with section('register'):
+        wf = diagstate(A,B,C,D).full()
     
-    inpt = pol2(inpt,cnot(),14,0,8,p2)
-    
-    inpt = pol1(inpt,snot(),14,2,p1)
-    inpt = pol1(inpt,snot(),14,0,p1)
-    
-    inpt = gate_expand_1toN(prjk,14,2)*inpt*gate_expand_1toN(prjk,14,2)*2
-    inpt = gate_expand_1toN(prjk,14,0)*inpt*gate_expand_1toN(prjk,14,0)*2
-    
-    inpt = pol1(inpt,snot(),14,4,p1)
-    inpt = gate_expand_1toN(prjk,14,4)*inpt*gate_expand_1toN(prjk,14,4)*2
-    
-    inpt = pol1(inpt,snot(),14,6,p1)
-    inpt = pol1(inpt,snot(),14,10,p1)
-    
-    inpt = gate_expand_1toN(prjk,14,6)*inpt*gate_expand_1toN(prjk,14,6)*2
-    inpt = gate_expand_1toN(prjk,14,10)*inpt*gate_expand_1toN(prjk,14,10)*2
-    
-    
-    a = inpt.ptrace([12,9])
-    q = ((fidelity(a,bell_state()))**2)
-    return q
\ No newline at end of file
+    a = Qobj(QNCPROTOCOL.run(wf,p1=p1,p2=p2,pproj=et), dims=[[2,2],[2,2]])
+    with section('fidelity'):
+        q = ((fidelity(a,bell_state()))**2)
+    return q
@@ -0,0 +1,56 @@
+#   Plotting and reporting of sweep results
+
+#   matplotlib is only imported when a figure is drawn, so the model
+#   modules and the worker processes of a sweep never load it.
+
+#   Parameters
+#   ---------------
+#   curves - List of (distance, value, label, style) tuples, one per line
+#   filename - File the figure is saved to as eps, or None
+#   show - Shows the figure once it is drawn
+
+def expenditure(curves,filename=None,show=True,title="Resource expenditure over distance (A)"):
+
+#   Plots Bell pair expenditure against distance, one line per curve
+
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    plt.xlabel('Distance/km')
+    plt.ylabel('Bell pair expenditure')
+    plt.grid()
+    plt.title(title)
+    for distance, value, label, style in curves:
+        plt.plot(distance,value,style,label=label)
+    plt.legend(loc='upper left')
+    if filename is not None:
+        plt.savefig(filename,format="eps")
+    if show:
+        plt.show()
+    return fig
+
+
+def nesting(curves,levels,filename=None,show=True,title="Closer look at resource jumps between 100-400km (B)"):
+
+#   Plots the optimal nesting level (points, left axis) and the Bell
+#   pair expenditure (lines, right axis) against distance. levels holds
+#   one (distance, nesting, label, style) tuple per scheme.
+
+    import matplotlib.pyplot as plt
+    fig, ax1 = plt.subplots()
+    ax2 = ax1.twinx()
+    ax1.grid()
+    plt.title(title)
+    for distance, value, label, style in levels:
+        ax1.plot(distance,value,style,label=label)
+    for distance, value, label, style in curves:
+        ax2.plot(distance,value,style,label=label)
+    ax1.set_xlabel('Distance/km')
+    ax1.set_ylabel('Optimal Nesting Level', color='k')
+    ax2.set_ylabel('Bell Pair Expenditure', color='k')
+    ax1.legend(loc='upper left')
+    ax2.legend(loc='lower right')
+    if filename is not None:
+        plt.savefig(filename,format="eps")
+    if show:
+        plt.show()
+    return fig
@@ -0,0 +1,88 @@
+#   Qubit elimination scheduling for measurement based protocols on a
+#   register of Bell pairs
+
+#   A protocol is a list of steps on global qubit indices (pair k holds
+#   qubits 2k and 2k + 1, as in qnces.py)
+#     (kind, op, q1, q2, ...) - operation op on the qubits q1, q2, ...
+#   followed by a partial trace onto the kept qubits. Only the qubits of
+#   a step are read here; protocol.py emits ('op', i, *targets), where i
+#   indexes its table of gates and measurements.
+
+#   Tracing out a qubit commutes with every operation on the other
+#   qubits, so a qubit that is not kept can be traced out right after the
+#   last step that touches it, and a pair only has to join the register
+#   when one of its qubits is first used (pairs that are never used and
+#   hold no kept qubit trace to 1 and are left out). The working register
+#   then grows and shrinks with the protocol instead of holding every
+#   pair until the end, while the result is the same linear map.
+
+#   plan turns a protocol into a list of events on local qubit positions
+#   of the working register
+#     ('pair', k)                      - append pair k to the register
+#     (kind, op, *local)               - a step, on local positions
+#     ('trace', q)                     - trace out local qubit q
+#     ('keep', order)                  - reduce to the local qubits in
+#                                        order (kept qubits in ascending
+#                                        global order)
+
+#   Parameters
+#   ---------------
+#   steps - Protocol steps on global qubit indices
+#   pairs - Number of Bell pairs in the register
+#   keep - Global indices of the qubits left at the end
+#   eager - Trace out and add qubits as early as possible; False keeps
+#           every pair from the start, as the original ESc/QNCc did
+
+def _qubits(step):
+    return list(step[2:])
+
+
+def plan(steps,pairs,keep,eager=True):
+
+#   Schedules a protocol, returning its events and the largest number of
+#   qubits the working register holds
+
+    keep = sorted(keep)
+    last = {}
+    for i, step in enumerate(steps):
+        for q in _qubits(step):
+            last[q] = i
+
+    live = []
+    events = []
+    width = 0
+
+    def add(pair):
+        live.extend([2 * pair, (2 * pair) + 1])
+        events.append(('pair', pair))
+
+    if not eager:
+        for pair in range(pairs):
+            add(pair)
+    width = len(live)
+
+    for i, step in enumerate(steps):
+        qubits = _qubits(step)
+        for q in qubits:
+            if q not in live:
+                add(q // 2)
+                partner = q ^ 1
+                if eager and partner not in keep and last.get(partner, -1) < i:
+                    width = max(width, len(live))
+                    events.append(('trace', live.index(partner)))
+                    live.remove(partner)
+        width = max(width, len(live))
+        local = [live.index(q) for q in qubits]
+        events.append(step[:-len(qubits)] + tuple(local))
+        if eager:
+            for q in qubits:
+                if last[q] == i and q not in keep:
+                    events.append(('trace', live.index(q)))
+                    live.remove(q)
+
+    for q in keep:
+        if q not in live:
+            add(q // 2)
+            width = max(width, len(live))
+    events.append(('keep', [live.index(q) for q in keep]))
+    return events, width
@@ -0,0 +1,324 @@
+#   Lookup table surrogate for the rounds and yield factor of purification
+
+#   oxbatch.rounds depends on a Bell diagonal pair (A, B, C, with
+#   D = 1 - A - B - C), pproj, p2 and fmin only; p1 enters through the
+#   connection, not the purification. The round count is a step function
+#   of fmin, so instead of tabulating it, build tabulates the smooth part:
+#   for every point of a grid over (A, B, C, pproj, p2) it stores A and
+#   the logarithm of the yield factor G after each of the first rounds of
+#   purifysym. G is a product over the rounds, so log G is a sum of
+#   smooth terms and interpolates with a smaller relative error than G.
+#   A query interpolates both trajectories multilinearly and takes the
+#   first round whose A reaches fmin, so fmin is free at query time. The
+#   tables are saved as .npy files, which Surrogate maps into memory
+#   without copying them.
+
+#   The interpolation error of every round of every cell is estimated
+#   when the table is built, as the larger of the error found at the cell
+#   centre and the bound h**2/8 |f''| from the second differences of the
+#   table. Each cell keeps, per round, twice the estimate for A as the
+#   margin of that round, or an infinite margin if the estimate for log G
+#   exceeds tol (about the relative error of G). A query falls back to
+#   exact evaluation with oxbatch.rounds when
+#   - it lies outside the grid,
+#   - the interpolated A of any round up to the one reaching fmin is
+#     within the margin of fmin (always so for rounds with an infinite
+#     margin), where the round count or G could be wrong, or
+#   - fmin is not reached within the tabulated rounds, which includes
+#     every fmin above the fixed point of the purification map.
+#   The exact fallback takes the fixed points from the cache of
+#   sweep.attractor (sweep.attractors), so a miss costs the purification
+#   rounds only once its (pproj, p2) has been seen.
+#   A separate random sample of table answers is checked against exact
+#   values when the table is built, and the result is saved with the axes
+#   in table.json.
+
+#   The table answers a minority of general queries. With the default
+#   axes, depth and tol, the validation sample (uniform over the grid,
+#   fmin uniform in 0.8 to 0.99) has 4022 valid pairs, of which
+#   - 1852 cannot reach fmin and always go to the fallback,
+#   - 734 are answered from the table, with no wrong round counts and G
+#     within 0.5 %, and
+#   - the remaining 1436 mostly start from A below 0.8 and need five or
+#     more rounds, where the trajectories bend too sharply for the
+#     margins of this grid. Finer axes help little (doubling the A, B
+#     and C axes, a table eight times larger, answers about 830).
+#   A single query answered from the table takes about 0.5 ms, and a miss
+#   about 1 to 2 ms once the fixed point of its (pproj, p2) is cached (4
+#   to 8 ms before). Surrogate.stats reports the split for the queries
+#   actually made.
+
+#   Parameters
+#   ---------------
+#   path - Directory of the table
+#   axes - Dictionary of increasing grid values for each of AXES
+#   depth - Number of tabulated purification rounds
+#   tol - Largest estimated error of log G accepted in a cell
+#   maxiter - Largest number of purification rounds of the exact fallback
+#   samples - Number of random points of the final validation
+#   A, B, C, D - Bell coefficients of the pair being purified
+#   pproj, p2 - Measurement and two qubit gate qualities, as in oxiter.py
+#   fmin - Desired output fidelity
+
+import json
+import os
+from itertools import product
+from numpy import (arange, asarray, broadcast_arrays, concatenate, diff, einsum, empty, full,
+                   exp, inf, isfinite, linspace, load, log, maximum, meshgrid, nan, nonzero, ones,
+                   prod, ravel_multi_index, save, searchsorted, where)
+from numpy.random import default_rng
+from .oxbatch import purifysym, rounds
+from .sweep import attractors
+from .sweepstore import _replace
+
+VERSION = 2
+
+AXES = ('A', 'B', 'C', 'pproj', 'p2')
+
+DEFAULT = {
+    'A': linspace(0.5, 1, 21),
+    'B': linspace(0, 0.3, 13),
+    'C': linspace(0, 0.3, 13),
+    'pproj': linspace(0.95, 1, 6),
+    'p2': linspace(0.95, 1, 6),
+}
+
+CORNERS = asarray(list(product((0, 1), repeat=len(AXES))))
+
+
+def _trajectory(A,B,C,pproj,p2,depth):
+
+#   Returns A and log G after 0..depth rounds of purifysym, one row per
+#   point
+
+    D = 1 - A - B - C
+    As = empty(A.shape + (depth + 1,))
+    Gs = empty(A.shape + (depth + 1,))
+    As[..., 0] = A
+    Gs[..., 0] = 0
+    for k in range(1, depth + 1):
+        A, B, C, D, N = purifysym(A,B,C,D,pproj,p2)
+        As[..., k] = A
+        Gs[..., k] = Gs[..., k - 1] + log(2/N)
+    return As, Gs
+
+
+def _cells(axes,points):
+
+#   Locates points (one array per axis) in the grid, returning the
+#   lower corner index and the fractional position along every axis, and
+#   whether each point lies inside the grid
+
+    index = []
+    frac = []
+    inside = ones(points[0].shape, dtype=bool)
+    for x, v in zip(axes, points):
+        i = searchsorted(x, v, side='right') - 1
+        i = i.clip(0, len(x) - 2)
+        index.append(i)
+        frac.append((v - x[i]) / (x[i + 1] - x[i]))
+        inside &= (v >= x[0]) & (v <= x[-1])
+    return index, frac, inside
+
+
+def _interpolate(T,index,frac):
+
+#   Multilinear interpolation of the trajectories T (grid axes followed
+#   by rounds) from the corners of the cells index at the fractional
+#   positions frac
+
+    grid = T.shape[:-1]
+    flat = T.reshape(-1, T.shape[-1])
+    strides = [int(prod(grid[axis + 1:])) for axis in range(len(grid))]
+    at = ravel_multi_index(index, grid) + (CORNERS @ strides)[:, None]
+    frac = asarray(frac)
+    weight = where(CORNERS[:, :, None] == 1, frac, 1 - frac).prod(axis=1)
+    return einsum('cm,cmk->mk', weight, flat[at])
+
+
+def _curvature(T):
+
+#   Estimates the multilinear interpolation error of every cell of the
+#   trajectories T from the second differences along each grid axis,
+#   h**2/8 |f''| summed over the axes, with |f''| h**2 taken as the
+#   largest second difference at the corners of the cell
+
+    grid = T.shape[:-1]
+    out = 0
+    for axis in range(len(grid)):
+        d2 = abs(diff(T, n=2, axis=axis))
+        edge = [slice(None)] * T.ndim
+        first, last = list(edge), list(edge)
+        first[axis], last[axis] = slice(0, 1), slice(-1, None)
+        d2 = concatenate([d2[tuple(first)], d2, d2[tuple(last)]], axis=axis)
+        for other in range(len(grid)):
+            lo, hi = list(edge), list(edge)
+            lo[other], hi[other] = slice(0, -1), slice(1, None)
+            d2 = maximum(d2[tuple(lo)], d2[tuple(hi)])
+        out = out + (d2 / 8)
+    return out
+
+
+def _write(path,name,array):
+    def write(tmp):
+        with open(tmp, 'wb') as f:
+            save(f, array)
+    _replace(os.path.join(path, name), write)
+
+
+def _checkpoint(path,meta):
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+    _replace(os.path.join(path, 'table.json'), write)
+
+
+def build(path,axes=None,depth=16,tol=1e-2,maxiter=1000,samples=10000,seed=0):
+
+#   Tabulates the trajectories on the grid, estimates the interpolation
+#   error of every cell and saves the table at path. Returns the opened
+#   Surrogate.
+
+    axes = dict(DEFAULT, **(axes or {}))
+    axes = [asarray(sorted(float(v) for v in axes[name])) for name in AXES]
+    if any(len(x) < 2 for x in axes):
+        raise ValueError("Every axis needs at least two grid values")
+
+#   Grid points beyond A + B + C = 1 are kept, with a negative D, so that
+#   the cells along the edge of the valid pairs can be interpolated
+    As, Gs = _trajectory(*meshgrid(*axes, indexing='ij'),depth)
+
+#   Interpolation error of every cell, at its centre and from the curvature
+    cells = tuple(len(x) - 1 for x in axes)
+    idx = [i.ravel() for i in meshgrid(*(arange(n) for n in cells), indexing='ij')]
+    half = [full(len(idx[0]), 0.5)] * len(AXES)
+    Ac, Gc = _trajectory(*((x[i] + x[i + 1]) / 2 for x, i in zip(axes, idx)),depth)
+    errA = maximum(abs(_interpolate(As, idx, half) - Ac),
+                   _curvature(As).reshape(Ac.shape))
+    errG = maximum(abs(_interpolate(Gs, idx, half) - Gc),
+                   _curvature(Gs).reshape(Gc.shape))
+    margin = 2 * errA
+    margin[~(isfinite(errA) & isfinite(errG) & (errG <= tol))] = inf
+    margin = margin.reshape(cells + (depth + 1,))
+
+    os.makedirs(path, exist_ok=True)
+    _write(path, 'A.npy', As)
+    _write(path, 'logG.npy', Gs)
+    _write(path, 'margin.npy', margin)
+    meta = {'version': VERSION, 'axes': {name: x.tolist() for name, x in zip(AXES, axes)},
+            'depth': depth, 'tol': tol, 'maxiter': maxiter, 'cells': int(margin[..., 0].size),
+            'usable': isfinite(margin).reshape(-1, depth + 1).sum(axis=0).tolist()}
+    _checkpoint(path, meta)
+
+    surrogate = Surrogate(path)
+    meta['validation'] = surrogate.validate(samples, seed)
+    _checkpoint(path, meta)
+    surrogate.meta = meta
+    return surrogate
+
+
+class Surrogate:
+
+#   Memory mapped lookup table answering rounds queries, falling back to
+#   exact evaluation where the table cannot be trusted
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'table.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != VERSION:
+            raise ValueError("Table at %s has version %s" % (path, self.meta['version']))
+        self.axes = [asarray(self.meta['axes'][name]) for name in AXES]
+        self.maxiter = self.meta['maxiter']
+        self.A = load(os.path.join(path, 'A.npy'), mmap_mode='r')
+        self.G = load(os.path.join(path, 'logG.npy'), mmap_mode='r')
+        self.margin = load(os.path.join(path, 'margin.npy'), mmap_mode='r')
+        self.hits = 0
+        self.exact = 0
+
+    def lookup(self, A, B, C, D, pproj, p2, fmin):
+
+#       Answers the points the table can be trusted for. Returns n, G and
+#       the mask of the points answered; the others are left at n = -1
+#       and G = nan.
+
+        args = broadcast_arrays(*(asarray(x, dtype=float) for x in (A, B, C, D, pproj, p2, fmin)))
+        shape = args[0].shape
+        A, B, C, D, pproj, p2, fmin = (x.ravel() for x in args)
+        n = full(A.shape, -1)
+        G = full(A.shape, nan)
+
+#       Pairs already at fmin need no rounds
+        done = A >= fmin
+        n[done] = 0
+        G[done] = 1
+
+        index, frac, inside = _cells(self.axes, [A, B, C, pproj, p2])
+        inside &= ~done & (abs(A + B + C + D - 1) < 1e-9)
+        where = nonzero(inside)
+        hit = done.copy()
+        if len(where[0]):
+            index = [i[where] for i in index]
+            frac = [t[where] for t in frac]
+            Ak = _interpolate(self.A, index, frac)
+            f = fmin[where][:, None]
+            reached = Ak >= f
+            k = reached.argmax(axis=1)
+            upto = arange(Ak.shape[1])[None, :] <= k[:, None]
+            clear = (abs(Ak - f) > self.margin[tuple(index)]) | ~upto
+            ok = reached.any(axis=1) & clear.all(axis=1)
+            Gk = _interpolate(self.G, index, frac)
+            sub = tuple(i[ok] for i in where)
+            n[sub] = k[ok]
+            G[sub] = exp(Gk[nonzero(ok)[0], k[ok]])
+            hit[sub] = True
+        return n.reshape(shape), G.reshape(shape), hit.reshape(shape)
+
+    def rounds(self, A, B, C, D, pproj, p2, fmin):
+
+#       Returns the number of rounds n and the yield factor G, as the
+#       first two outputs of oxbatch.rounds (n = -1 and G = nan where
+#       fmin cannot be reached)
+
+        args = broadcast_arrays(*(asarray(x, dtype=float) for x in (A, B, C, D, pproj, p2, fmin)))
+        shape = args[0].shape
+        args = [x.ravel() for x in args]
+        n, G, hit = self.lookup(*args)
+        miss = nonzero(~hit)[0]
+        if len(miss):
+            star = attractors(args[4][miss], args[5][miss])
+            n[miss], G[miss] = rounds(*(x[miss] for x in args),self.maxiter,star)[:2]
+        self.hits = self.hits + int(hit.sum())
+        self.exact = self.exact + len(miss)
+        return n.reshape(shape), G.reshape(shape)
+
+    def validate(self, samples=10000, seed=0, fmin=(0.8, 0.99)):
+
+#       Compares table answers at random points of the grid, with fmin
+#       drawn from the range fmin, with exact values. Returns the number
+#       of points, how many cannot reach fmin, how many the table
+#       answered, how many of those got the round count wrong and the
+#       largest relative error of G.
+
+        rng = default_rng(seed)
+        A, B, C, pproj, p2 = (rng.uniform(x[0], x[-1], samples) for x in self.axes)
+        keep = (A + B + C) <= 1
+        points = [x[keep] for x in (A, B, C)]
+        points.append(1 - points[0] - points[1] - points[2])
+        points.extend(x[keep] for x in (pproj, p2))
+        points.append(rng.uniform(fmin[0], fmin[1], len(points[0])))
+        n, G, hit = self.lookup(*points)
+        ne, Ge = rounds(*points,self.maxiter,attractors(points[4], points[5]))[:2]
+        error = abs(G[hit] - Ge[hit]) / abs(Ge[hit])
+        return {'points': int(keep.sum()), 'unreachable': int((ne < 0).sum()),
+                'table': int(hit.sum()),
+                'rounds': int((n[hit] != ne[hit]).sum()),
+                'error': float(error.max()) if len(error) else 0.0}
+
+    def stats(self):
+
+#       Reports how many queries the table answered and how many were
+#       evaluated exactly
+
+        return {'table': self.hits, 'exact': self.exact,
+                'usable': self.meta['usable'], 'cells': self.meta['cells']}
@@ -0,0 +1,280 @@
+#   Parameter sweep driver for the nested entanglement swapping and
+#   purification model of mainmodel.py
+
+#   Each (p1, p2, pproj, fmin) setting and distance is independent of every
+#   other, so the grid is split into one task per (setting, distance) and
+#   the tasks are spread across a process pool. Results are written into
+#   preallocated arrays, and the full expenditure grid over nesting levels
+#   is kept alongside the per-distance optimum.
+
+#   A level's outcome depends only on the segment transmission
+#   pfib = 10**(-att*L/2**xn/10), the level index and the noise
+#   parameters, so per-level purification outcomes are memoized in a
+#   bounded LRU cache (one per process). Every (L, xn) with the same
+#   segment length reuses them. Segment fidelities come in closed form
+#   from bellchan.py.
+
+#   streamsweep writes the results to a sweepstore.SweepStore one chunk of
+#   tasks at a time instead of holding the whole grid, and picks up where
+#   an interrupted run stopped.
+
+#   chainkernel.kernelgrid computes the grid of sweepgrid in one call,
+#   with a compiled kernel when numba is installed.
+
+#   Parameters
+#   ---------------
+#   L - Channel lengths in km
+#   NN - Nesting levels to consider
+#   p1, p2, pproj - Gate and measurement qualities, as in oxiter.py. Each
+#                   may be a single value or a sequence of values
+#   fmin - Desired output fidelity, a single value or a sequence
+#   att - Attenuation coefficient of the fibre in dB/km
+#   processes - Number of worker processes (None uses every core,
+#               1 runs in the calling process)
+#   path - Directory of the result store used by streamsweep
+#   chunk - Number of (setting, distance) tasks per stored chunk
+
+from itertools import product
+from multiprocessing import Pool
+from os import cpu_count
+from numpy import asarray, atleast_1d, broadcast_arrays, empty, isnan, nan, nanargmin, zeros
+from .bellchan import fibre, transmission
+from .oxbatch import connect, fixedpoint, rounds
+from .memo import LRUCache, roundkey
+from .sweepstore import SweepStore
+
+LEVELS = LRUCache(65536)
+FIXED = LRUCache(1024)
+
+TABLE = [('p1', float), ('p2', float), ('pproj', float), ('fmin', float),
+         ('distance', float), ('expenditure', float), ('nesting', int)]
+
+
+def segment(pfib):
+
+#   Calculates the 00 + 11 weighting of a Bell pair after one fibre
+#   segment with transmission pfib
+
+    return fibre(pfib)[0]
+
+
+def level(pfib,j,p1,p2,pproj,fmin):
+
+#   Calculates the coefficients (A, B, C, D) and yield factor G after
+#   the connection and purification of nesting level j (counted from 0)
+#   for segments of transmission pfib. G is nan when purification cannot
+#   reach fmin at this or an earlier level.
+
+    key = roundkey(pfib,j,p1,p2,pproj,fmin)
+    out = LEVELS.get(key)
+    if out is not None:
+        return out
+
+    if j == 0:
+        A = segment(pfib)
+        B = C = D = (1-A)/3
+    else:
+        A, B, C, D, G = level(pfib,j-1,p1,p2,pproj,fmin)
+        if isnan(G):
+            LEVELS.put(key, (A, B, C, D, G))
+            return A, B, C, D, G
+
+    A, B, C, D = connect(A,B,C,D,pproj,p1,p2)
+    if A > fmin:
+        G = 2
+    else:
+        n, G, A, B, C, D, reached = rounds(A,B,C,D,pproj,p2,fmin,star=attractor(pproj,p2))
+        A, B, C, D, G = float(A), float(B), float(C), float(D), float(G)
+    out = (A, B, C, D, G)
+    LEVELS.put(key, out)
+    return out
+
+
+def attractor(pproj,p2):
+
+#   Returns the cached fixed point of the purification map
+
+    key = roundkey(pproj,p2)
+    star = FIXED.get(key)
+    if star is None:
+        star = fixedpoint(pproj,p2)
+        FIXED.put(key, star)
+    return star
+
+
+def attractors(pproj,p2):
+
+#   Returns the fixed points (A, B, C, D) for arrays of pproj and p2,
+#   taking those already cached by attractor and finding the others in
+#   a single batched fixedpoint call
+
+    pproj, p2 = broadcast_arrays(asarray(pproj, dtype=float), asarray(p2, dtype=float))
+    keys = [roundkey(float(a), float(b)) for a, b in zip(pproj.ravel(), p2.ravel())]
+    found = {}
+    for key in dict.fromkeys(keys):
+        star = FIXED.get(key)
+        if star is not None:
+            found[key] = tuple(float(x) for x in star)
+    todo = [key for key in dict.fromkeys(keys) if key not in found]
+    if todo:
+        stars = fixedpoint(*asarray(todo).T)
+        for j, key in enumerate(todo):
+            found[key] = tuple(float(x[j]) for x in stars)
+            FIXED.put(key, found[key])
+    return tuple(asarray([found[key][i] for key in keys]).reshape(pproj.shape) for i in range(4))
+
+
+def chain(il,xn,p1,p2,pproj,fmin,att=0.17):
+
+#   Calculates the Bell pair expenditure of a channel of length il split
+#   by xn nesting levels, or nan if purification cannot reach fmin.
+
+    pfib = transmission(il/(2**xn),att)
+    AP = 0
+    for j in range(xn):
+        G = level(pfib,j,p1,p2,pproj,fmin)[4]
+        AP = AP + ((2 ** (xn - 1 - j)) * G)
+        if isnan(G):
+            break
+    return AP
+
+
+def cachestats():
+
+#   Reports hit/miss statistics of this process's level cache
+
+    return {'levels': LEVELS.stats()}
+
+
+def _levels(task):
+
+#   Evaluates every nesting level for one setting and distance
+
+    il, NN, p1, p2, pproj, fmin, att = task
+    out = empty(len(NN))
+    for k, xn in enumerate(NN):
+        out[k] = chain(il,int(xn),p1,p2,pproj,fmin,att)
+    return out
+
+
+def best(levels,NN):
+
+#   Returns the lowest expenditure over nesting levels and the nesting
+#   level it is reached at, or (nan, 0) if fmin is never reached
+
+    if isnan(levels).all():
+        return nan, 0
+    k = nanargmin(levels)
+    return levels[k], NN[k]
+
+
+def settings(p1,p2,pproj,fmin):
+
+#   Lists every combination of the noise parameters and target fidelity
+
+    return list(product(atleast_1d(p1), atleast_1d(p2),
+                        atleast_1d(pproj), atleast_1d(fmin)))
+
+
+def sweepgrid(L,NN,p1,p2,pproj,fmin,att=0.17,processes=None):
+
+#   Calculates the expenditure for every setting, distance and nesting
+#   level. Returns an array of shape (settings, len(L), len(NN)) holding
+#   nan where the target fidelity cannot be reached.
+
+    L = atleast_1d(L)
+    NN = atleast_1d(NN)
+    grid = settings(p1,p2,pproj,fmin)
+    tasks = [(il, NN) + s + (att,) for s in grid for il in L]
+
+    out = empty((len(grid), len(L), len(NN)))
+    flat = out.reshape(len(tasks), len(NN))
+    if processes == 1:
+        for k, task in enumerate(tasks):
+            flat[k] = _levels(task)
+    else:
+        workers = processes or cpu_count()
+        chunk = max(1, len(tasks) // (4 * workers))
+        with Pool(workers) as pool:
+            for k, row in enumerate(pool.imap(_levels, tasks, chunk)):
+                flat[k] = row
+    return out
+
+
+def optimum(grid,L,NN,p1,p2,pproj,fmin):
+
+#   Reduces an expenditure grid from sweepgrid to the cheapest nesting
+#   level per setting and distance, as a structured array with the
+#   fields of TABLE
+
+    L = atleast_1d(L)
+    NN = atleast_1d(NN)
+    combos = settings(p1,p2,pproj,fmin)
+    table = zeros((len(combos), len(L)), dtype=TABLE)
+    for k, name in enumerate(['p1', 'p2', 'pproj', 'fmin']):
+        table[name] = [[combo[k]] for combo in combos]
+    table['distance'] = L
+    table['expenditure'] = nan
+    for s in range(len(combos)):
+        for l in range(len(L)):
+            table[s, l]['expenditure'], table[s, l]['nesting'] = best(grid[s, l],NN)
+    return table.ravel()
+
+
+def sweep(L,NN,p1,p2,pproj,fmin,att=0.17,processes=None):
+
+#   Runs the full sweep and returns the per-distance optimum table
+#   together with the expenditure grid it was taken from
+
+    grid = sweepgrid(L,NN,p1,p2,pproj,fmin,att,processes)
+    return optimum(grid,L,NN,p1,p2,pproj,fmin), grid
+
+
+def _task(k,L,NN,combos,att):
+
+#   Builds task k of the setting-major, distance-minor task order
+
+    s, l = divmod(k, len(L))
+    return (L[l], NN) + combos[s] + (att,)
+
+
+def _chunk(store,c,tasks,rows,NN):
+
+#   Collects the rows of one chunk with their optimum and saves them
+
+    grid = empty((len(tasks), len(NN)))
+    table = zeros(len(tasks), dtype=TABLE)
+    for i, (task, row) in enumerate(zip(tasks, rows)):
+        il, _, p1, p2, pproj, fmin, _ = task
+        grid[i] = row
+        table[i] = (p1, p2, pproj, fmin, il) + best(row,NN)
+    store.write(c, grid, table)
+
+
+def streamsweep(path,L,NN,p1,p2,pproj,fmin,att=0.17,processes=None,chunk=1024):
+
+#   Runs the sweep into the store at path chunk by chunk, skipping the
+#   chunks a previous run already completed, and returns the store. Only
+#   one chunk of results is held in memory at a time.
+
+    L = atleast_1d(L)
+    NN = atleast_1d(NN)
+    combos = settings(p1,p2,pproj,fmin)
+    params = {'L': L, 'NN': NN, 'p1': p1, 'p2': p2, 'pproj': pproj, 'fmin': fmin, 'att': att}
+    store = SweepStore(path, params, len(combos) * len(L), chunk)
+    pending = store.pending()
+    if not pending:
+        return store
+
+    if processes == 1:
+        for c in pending:
+            tasks = [_task(k,L,NN,combos,att) for k in store.span(c)]
+            _chunk(store,c,tasks,map(_levels, tasks),NN)
+    else:
+        workers = processes or cpu_count()
+        with Pool(workers) as pool:
+            for c in pending:
+                tasks = [_task(k,L,NN,combos,att) for k in store.span(c)]
+                size = max(1, len(tasks) // (4 * workers))
+                _chunk(store,c,tasks,pool.imap(_levels, tasks, size),NN)
+    return store
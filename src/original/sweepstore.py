@@ -0,0 +1,156 @@
+#   On-disk store for sweep results, written chunk by chunk so that a
+#   long sweep keeps flat memory and can resume after an interruption
+
+#   A store is a directory holding
+#     manifest.json  - sweep parameters, chunk size and completed chunks
+#     chunk-NNNNN.npz - for a run of consecutive tasks: their task
+#                       indices, expenditure rows over nesting levels
+#                       ('grid') and optimum rows ('table', fields of
+#                       sweep.TABLE)
+#   Tasks are numbered setting-major, distance-minor, as in sweepgrid.
+#   Every file is written to a temporary name and renamed into place, and
+#   a chunk only counts as done once the manifest lists it, so a crash
+#   never leaves a half written chunk behind.
+
+#   Parameters
+#   ---------------
+#   path - Directory of the store
+#   params - Dictionary of the sweep parameters (L, NN, p1, p2, pproj,
+#            fmin, att), used to refuse resuming a different sweep
+#   chunk - Number of tasks per chunk file
+
+import json
+import os
+from numpy import atleast_1d, concatenate, empty, load, savez
+
+VERSION = 1
+
+
+def _jsonable(params):
+
+#   Converts the sweep parameters to plain lists and floats
+
+    out = {}
+    for name, value in params.items():
+        value = atleast_1d(value).tolist()
+        out[name] = value if len(value) > 1 or name in ('L', 'NN') else value[0]
+    return out
+
+
+def _replace(path, write):
+
+#   Writes a file through write(temporary path), then renames it into
+#   place
+
+    tmp = path + '.tmp'
+    write(tmp)
+    os.replace(tmp, path)
+
+
+class SweepStore:
+
+#   Directory of chunked sweep results with a JSON checkpoint
+
+    def __init__(self, path, params, tasks, chunk=1024):
+        self.path = path
+        self.params = _jsonable(params)
+        self.tasks = tasks
+        self.chunk = chunk
+        self.done = set()
+        manifest = os.path.join(path, 'manifest.json')
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                saved = json.load(f)
+            if saved['params'] != self.params or saved['tasks'] != tasks or saved['chunk'] != chunk:
+                raise ValueError('Store at %s holds a different sweep' % path)
+            self.done = set(saved['done'])
+        else:
+            os.makedirs(path, exist_ok=True)
+            self._checkpoint()
+
+    @classmethod
+    def open(cls, path):
+
+#       Opens an existing store for reading
+
+        with open(os.path.join(path, 'manifest.json')) as f:
+            saved = json.load(f)
+        return cls(path, saved['params'], saved['tasks'], saved['chunk'])
+
+    def _checkpoint(self):
+        manifest = {'version': VERSION, 'params': self.params, 'tasks': self.tasks,
+                    'chunk': self.chunk, 'done': sorted(self.done)}
+
+        def write(tmp):
+            with open(tmp, 'w') as f:
+                json.dump(manifest, f)
+        _replace(os.path.join(self.path, 'manifest.json'), write)
+
+    def chunks(self):
+        return (self.tasks + self.chunk - 1) // self.chunk
+
+    def span(self, c):
+
+#       Task indices covered by chunk c
+
+        return range(c * self.chunk, min((c + 1) * self.chunk, self.tasks))
+
+    def pending(self):
+        return [c for c in range(self.chunks()) if c not in self.done]
+
+    def complete(self):
+        return len(self.done) == self.chunks()
+
+    def filename(self, c):
+        return os.path.join(self.path, 'chunk-%05d.npz' % c)
+
+    def write(self, c, grid, table):
+
+#       Saves the rows of chunk c and marks it as done
+
+        index = list(self.span(c))
+
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                savez(f, index=index, grid=grid, table=table)
+        _replace(self.filename(c), write)
+        self.done.add(c)
+        self._checkpoint()
+
+    def read(self, c):
+        with load(self.filename(c)) as data:
+            return data['index'], data['grid'], data['table']
+
+    def iterchunks(self):
+
+#       Yields (index, grid, table) for every completed chunk in task
+#       order, one chunk in memory at a time
+
+        for c in sorted(self.done):
+            yield self.read(c)
+
+    def table(self):
+
+#       Concatenates the optimum rows of every completed chunk
+
+        tables = [table for _, _, table in self.iterchunks()]
+        return concatenate(tables) if tables else empty(0)
+
+    def grid(self):
+
+#       Concatenates the expenditure rows of every completed chunk, one
+#       row over nesting levels per task
+
+        grids = [grid for _, grid, _ in self.iterchunks()]
+        return concatenate(grids) if grids else empty((0, len(self.params['NN'])))
+
+    def tocsv(self, filename, fields=('expenditure', 'distance', 'nesting')):
+
+#       Streams the chosen optimum fields of every completed chunk to a
+#       CSV file
+
+        with open(filename, 'w') as f:
+            f.write('# ' + ','.join(fields) + '\n')
+            for _, _, table in self.iterchunks():
+                for row in table:
+                    f.write(','.join(repr(row[name].item()) for name in fields) + '\n')
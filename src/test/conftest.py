@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Tests import the packages of src (original, func, circuits) the way the
+# scripts do when run from the src directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,40 @@
+#%%
+import numpy as np
+import pytest
+from qutip import bell_state, fidelity, ket2dm, qeye
+
+from original.bellchan import fibre, fromwerner, linkwerner, werner
+from original.qnces import pol1
+
+PFIB = np.linspace(0.5, 1, 11)
+
+
+def _pair():
+    return ket2dm(bell_state())
+
+
+def _weight(rho):
+    """
+    Squared fidelity of a two qubit state with 00 + 11.
+    """
+    return fidelity(rho, _pair())**2
+
+
+#%%
+
+@pytest.mark.parametrize("qubit", [0, 1])
+def test_fibre_matches_pol1(qubit):
+    expected = [_weight(pol1(_pair(), qeye(2), 2, qubit, p)) for p in PFIB]
+    assert np.allclose(fibre(PFIB)[0], expected, rtol=0, atol=1e-7)
+
+
+def test_fibre_is_werner():
+    A, B, C, D = fibre(PFIB)
+    assert np.allclose(A + B + C + D, 1)
+    assert np.allclose(fromwerner(werner(A))[1], B)
+
+
+@pytest.mark.parametrize("p, q", [(0.9, 0.95), (0.7, 0.99), (1.0, 0.8)])
+def test_linkwerner_matches_chained_pol1(p, q):
+    rho = pol1(pol1(_pair(), qeye(2), 2, 0, p), qeye(2), 2, 1, q)
+    assert abs(linkwerner(p, q) - werner(_weight(rho))) < 1e-7
@@ -0,0 +1,40 @@
+#%%
+import numpy as np
+import pytest
+
+from original.chainkernel import NUMBA, chains, kernelgrid
+from original.sweep import chain, settings
+
+L = np.array([10.0, 60.0, 150.0])
+NN = np.array([1, 2, 3])
+P = [0.99, 0.995]
+FMIN = [0.9, 0.97]
+
+
+def _expected():
+    """
+    The grid of kernelgrid, one sweep.chain call per point.
+    """
+    grid = settings(P, 0.99, P, FMIN)
+    return np.array([[[chain(il, xn, p1, p2, pproj, fmin) for xn in NN] for il in L]
+                     for p1, p2, pproj, fmin in grid])
+
+
+#%%
+
+@pytest.mark.parametrize("backend", [
+    "numpy",
+    pytest.param("numba", marks=pytest.mark.skipif(not NUMBA, reason="numba is not installed")),
+])
+def test_kernelgrid_matches_chain(backend):
+    expected = _expected()
+    out = kernelgrid(L, NN, P, 0.99, P, FMIN, backend=backend)
+    assert out.shape == expected.shape
+    assert np.isnan(expected).any() and not np.isnan(expected).all()
+    assert np.array_equal(np.isnan(out), np.isnan(expected))
+    assert np.allclose(out, expected, rtol=1e-10, atol=0, equal_nan=True)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        chains(L, 1, 0.99, 0.99, 0.99, 0.9, backend="cuda")
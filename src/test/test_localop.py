@@ -0,0 +1,135 @@
+#%%
+import numpy as np
+import pytest
+from qutip import Qobj, bell_state, fidelity, rand_dm, sigmax, sigmay, sigmaz, tensor
+from qutip.qip.operations import cnot, gate_expand_1toN, gate_expand_2toN, snot
+
+from circuits.repeater import es_protocol, swap_chain
+from original.belldiag import BellDiag
+from original.localop import ptrace, sandwich, twirl
+from original.oxiter import diagstate
+from original.protocol import compile_protocol
+from original.qnces import ESc, pol1, pol2
+
+PAULI = [sigmax(), sigmay(), sigmaz()]
+
+COEFFS = [(0.9, 0.05, 0.03, 0.02), (0.7, 0.1, 0.15, 0.05)]
+
+
+def _register(N, seed):
+    return rand_dm(2**N, dims=[[2] * N, [2] * N], seed=seed)
+
+
+def _pol1(qob, gate, N, t, p):
+    """
+    pol1 built from full-register operators, as qnces.py first did.
+    """
+    G = gate_expand_1toN(gate, N, t)
+    noise = sum(P * qob * P for P in (gate_expand_1toN(E, N, t) for E in PAULI))
+    return (p * (G * qob * G)) + (((1 - p) / 3) * noise)
+
+
+def _pol2(qob, gate, N, c, t, p):
+    """
+    pol2 built from full-register operators, as qnces.py first did.
+    """
+    G = gate_expand_2toN(gate, N, c, t)
+    terms = [gate_expand_1toN(E, N, q) for q in (c, t) for E in PAULI]
+    terms += [gate_expand_2toN(tensor([E, F]), N, c, t)
+              for i, E in enumerate(PAULI) for j, F in enumerate(PAULI) if i != j]
+    noise = sum(P * qob * P for P in terms)
+    return (p * (G * qob * G)) + (((1 - p) / 12) * noise)
+
+
+def _run(protocol, wf, params):
+    """
+    Runs a protocol of circuits/repeater.py step by step on the full
+    register.
+    """
+    N = 2 * protocol["pairs"]
+    rho = tensor([wf] * protocol["pairs"])
+    for stage in protocol["circuit"]:
+        for operation in stage["operations"]:
+            gate, targets, name = operation[0], operation[1], operation[2]
+            if isinstance(gate, str):
+                et = params[name]
+                M = gate_expand_1toN(Qobj(np.diag([et, 1 - et])), N, targets[0])
+                rho = 2 * (M * rho * M)
+            elif len(targets) == 1:
+                rho = _pol1(rho, gate, N, targets[0], params[name])
+            else:
+                rho = _pol2(rho, gate, N, targets[0], targets[1], params[name])
+    return rho.ptrace(protocol["keep"]).full()
+
+
+#%%
+
+@pytest.mark.parametrize("targets", [[2], [3, 1], [0, 2]])
+def test_sandwich_matches_expanded(targets):
+    rho = _register(4, 1)
+    left = rand_dm(2**len(targets), seed=2)
+    if len(targets) == 1:
+        full = gate_expand_1toN(left, 4, targets[0])
+    else:
+        full = gate_expand_2toN(Qobj(left.full(), dims=[[2, 2], [2, 2]]), 4, *targets)
+    out = sandwich(rho.full(), left.full(), left.full(), targets, 4)
+    assert np.allclose(out, (full * rho * full).full(), rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("targets", [[1], [3, 0]])
+def test_twirl_matches_expanded(targets):
+    rho = _register(4, 3)
+    ops = [gate_expand_1toN(E, 4, targets[0]) for E in [Qobj(np.eye(2))] + PAULI]
+    for t in targets[1:]:
+        ops = [P * gate_expand_1toN(E, 4, t) for P in ops for E in [Qobj(np.eye(2))] + PAULI]
+    expected = sum(P * rho * P for P in ops).full()
+    assert np.allclose(twirl(rho.full(), targets, 4), expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("keep", [[0, 3], [2], [1, 2, 3]])
+def test_ptrace_matches_qobj(keep):
+    rho = _register(4, 4)
+    assert np.allclose(ptrace(rho.full(), keep, 4), rho.ptrace(keep).full(), rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("gate, t", [(snot(), 1), (sigmax(), 2), (sigmaz(), 0)])
+def test_pol1_matches_expanded(gate, t):
+    rho = _register(4, 5)
+    bell = BellDiag.product(COEFFS)
+    for qob in (rho, bell.dense()):
+        assert np.allclose(pol1(qob, gate, 4, t, 0.93).full(), _pol1(qob, gate, 4, t, 0.93).full(),
+                           rtol=0, atol=1e-12)
+    out = pol1(bell, gate, 4, t, 0.93)
+    out = out.dense() if isinstance(out, BellDiag) else out
+    assert np.allclose(out.full(), _pol1(bell.dense(), gate, 4, t, 0.93).full(), rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("gate, c, t", [(cnot(), 0, 2), (cnot(), 3, 1),
+                                        (tensor([sigmax(), sigmaz()]), 1, 2)])
+def test_pol2_matches_expanded(gate, c, t):
+    rho = _register(4, 6)
+    bell = BellDiag.product(COEFFS)
+    for qob in (rho, bell.dense()):
+        assert np.allclose(pol2(qob, gate, 4, c, t, 0.91).full(),
+                           _pol2(qob, gate, 4, c, t, 0.91).full(), rtol=0, atol=1e-12)
+    out = pol2(bell, gate, 4, c, t, 0.91)
+    out = out.dense() if isinstance(out, BellDiag) else out
+    assert np.allclose(out.full(), _pol2(bell.dense(), gate, 4, c, t, 0.91).full(),
+                       rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("protocol", [es_protocol, swap_chain(4)])
+def test_protocol_matches_expanded(protocol):
+    params = {'p1': 0.97, 'p2': 0.95, 'pproj': 0.98}
+    compiled = compile_protocol(protocol)
+    for wf in (diagstate(*COEFFS[1]), rand_dm(4, dims=[[2, 2], [2, 2]], seed=7)):
+        expected = _run(protocol, wf, params)
+        assert np.allclose(compiled.run(wf, **params), expected, rtol=0, atol=1e-10)
+
+
+@pytest.mark.parametrize("coeffs", COEFFS)
+def test_esc_matches_expanded(coeffs):
+    params = {'p1': 0.99, 'p2': 0.97, 'pproj': 0.96}
+    rho = Qobj(_run(es_protocol, diagstate(*coeffs), params), dims=[[2, 2], [2, 2]])
+    expected = fidelity(rho, bell_state())**2
+    assert abs(ESc(params['p1'], params['p2'], params['pproj'], *coeffs) - expected) < 1e-7